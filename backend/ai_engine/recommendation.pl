@@ -3,8 +3,47 @@
 
 :- dynamic movie/7.
 :- dynamic user_likes/2.
+:- dynamic movie_genre/2.
+:- dynamic movie_mood/2.
 % movie(ID, Title, Genres, Moods, MinAge, ReleaseYear, PopularityScore).
 % user_likes(UserID, MovieID).
+% movie_genre(Genre, ID) / movie_mood(Mood, ID): inverted indexes over movie/7,
+% so a genre or mood lookup hits first-argument indexing instead of scanning
+% every movie. Always go through add_movie/7 and remove_movie/1.
+
+add_movie(ID, Title, Genres, Moods, MinAge, ReleaseYear, Popularity) :-
+    assertz(movie(ID, Title, Genres, Moods, MinAge, ReleaseYear, Popularity)),
+    sort(Genres, UniqueGenres),
+    forall(member(G, UniqueGenres), assertz(movie_genre(G, ID))),
+    sort(Moods, UniqueMoods),
+    forall(member(M, UniqueMoods), assertz(movie_mood(M, ID))).
+
+remove_movie(ID) :-
+    retractall(movie(ID, _, _, _, _, _, _)),
+    retractall(movie_genre(_, ID)),
+    retractall(movie_mood(_, ID)).
+
+% Bulk loading: assert every fact in File in a single call, instead of one
+% assertz round trip per fact. Terms are read and asserted rather than
+% consulted so movie/7 and user_likes/2 stay dynamic and nothing already in
+% the KB is wiped. A malformed term is reported and skipped.
+bulk_load_facts(File) :-
+    setup_call_cleanup(open(File, read, In, [encoding(utf8)]),
+                       load_fact_stream(In),
+                       close(In)).
+
+load_fact_stream(In) :-
+    read_term(In, Term, [syntax_errors(dec10)]),
+    (   Term == end_of_file
+    ->  true
+    ;   assert_fact(Term),
+        load_fact_stream(In)
+    ).
+
+assert_fact(movie(ID, Title, Genres, Moods, MinAge, ReleaseYear, Popularity)) :- !,
+    add_movie(ID, Title, Genres, Moods, MinAge, ReleaseYear, Popularity).
+assert_fact(user_likes(UserID, MovieID)) :- user_likes(UserID, MovieID), !.
+assert_fact(Fact) :- assertz(Fact).
 
 % Helper: Match preference or accept 'any'
 match_pref(Pref, _) :- Pref == any.
@@ -16,30 +55,68 @@ check_rating(UserAge, MinAge) :- UserAge >= MinAge.
 % Rules: Recommend a movie based on Genre, Mood, and Age
 % recommend_movie(Genre, Mood, UserAge, ID, Title, Explanation, Popularity).
 recommend_movie(PrefGenre, PrefMood, UserAge, ID, Title, Explanation, Popularity) :-
+    candidate_movie(PrefGenre, PrefMood, ID),
     movie(ID, Title, Genres, Moods, MinAge, _, Popularity),
     check_rating(UserAge, MinAge),
     match_pref(PrefGenre, Genres),
     match_pref(PrefMood, Moods),
     construct_explanation(PrefGenre, PrefMood, Title, MinAge, Genres, Moods, Explanation).
 
+% Helper: Enumerate candidate IDs from the most specific index available
+candidate_movie(any, any, ID) :- !, movie(ID, _, _, _, _, _, _).
+candidate_movie(any, PrefMood, ID) :- !, movie_mood(PrefMood, ID).
+candidate_movie(PrefGenre, _, ID) :- movie_genre(PrefGenre, ID).
+
 % Rules: Recommend a movie from a strictly provided list of IDs (Hybrid AI)
+% Driven from the pool: each ID is an indexed movie/7 lookup.
 recommend_movie_in_pool(PrefGenre, PrefMood, UserAge, PoolIDs, ID, Title, Explanation, Popularity) :-
-    movie(ID, Title, Genres, Moods, MinAge, _, Popularity),
     member(ID, PoolIDs),
+    movie(ID, Title, Genres, Moods, MinAge, _, Popularity),
     check_rating(UserAge, MinAge),
     match_pref(PrefGenre, Genres),
     match_pref(PrefMood, Moods),
     construct_explanation(PrefGenre, PrefMood, Title, MinAge, Genres, Moods, Explanation).
 
+% Relaxation ladder: the (Genre, Mood) constraints tried, in order, when the
+% stricter ones match nothing. Keep in step with relaxation_tiers() in reasoning.py.
+% relaxation(PrefGenre, PrefMood, Tier, Genre, Mood).
+relaxation(PrefGenre, PrefMood, 0, PrefGenre, PrefMood).
+relaxation(PrefGenre, PrefMood, 1, PrefGenre, any) :- PrefMood \== any.
+relaxation(PrefGenre, PrefMood, 2, any, PrefMood) :- PrefGenre \== any.
+relaxation(PrefGenre, PrefMood, 3, any, any) :- \+ (PrefGenre == any, PrefMood == any).
+
+% Rules: The results of the first relaxation tier that has any, in one call.
+% Tier says how far the constraints had to be relaxed (0 = not at all).
+recommend_movie_relaxed(PrefGenre, PrefMood, UserAge, Tier, ID, Title, Explanation, Popularity) :-
+    relaxation(PrefGenre, PrefMood, Tier, Genre, Mood),
+    findall(r(ID, Title, Explanation, Popularity),
+            recommend_movie(Genre, Mood, UserAge, ID, Title, Explanation, Popularity),
+            Results),
+    Results \== [], !,
+    member(r(ID, Title, Explanation, Popularity), Results).
+
+recommend_movie_in_pool_relaxed(PrefGenre, PrefMood, UserAge, PoolIDs, Tier, ID, Title, Explanation, Popularity) :-
+    relaxation(PrefGenre, PrefMood, Tier, Genre, Mood),
+    findall(r(ID, Title, Explanation, Popularity),
+            recommend_movie_in_pool(Genre, Mood, UserAge, PoolIDs, ID, Title, Explanation, Popularity),
+            Results),
+    Results \== [], !,
+    member(r(ID, Title, Explanation, Popularity), Results).
+
 % Rules: Recommend a movie based on user's watch history (Collaborative/Content Hybrid)
 recommend_similar_to_liked(UserID, UserAge, ID, Title, Explanation, Popularity) :-
     user_likes(UserID, LikedMovieID),
+    similar_to_movie(LikedMovieID, ID, Title, MinAge, Popularity, Explanation),
+    check_rating(UserAge, MinAge).
+
+% Movies sharing a genre and a mood with LikedMovieID, for any age. The
+% per-user results are materialised from this one liked movie at a time.
+similar_to_movie(LikedMovieID, ID, Title, MinAge, Popularity, Explanation) :-
     movie(LikedMovieID, LikedTitle, LikedGenres, LikedMoods, _, _, _),
-    movie(ID, Title, Genres, Moods, MinAge, _, Popularity),
+    member(G, LikedGenres), movie_genre(G, ID),
+    member(M, LikedMoods), movie_mood(M, ID),
+    movie(ID, Title, _, _, MinAge, _, Popularity),
     Title \== LikedTitle,
-    check_rating(UserAge, MinAge),
-    member(G, LikedGenres), member(G, Genres),
-    member(M, LikedMoods), member(M, Moods),
     atomic_list_concat(['Recommended because you liked ', LikedTitle, ', which shares the ', G, ' genre and ', M, ' vibe.'], Explanation).
 
 % Explanation Generation
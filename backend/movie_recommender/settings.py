@@ -147,6 +147,81 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
+# Cache for get_recommendations results. Local memory (per process, LRU) by
+# default; point CACHE_REDIS_URL at Redis (e.g. the Celery broker) to share
+# entries between workers.
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '2000'))},
+        }
+    }
+RECOMMENDATION_CACHE_TTL = int(os.getenv('RECOMMENDATION_CACHE_TTL', '300'))  # seconds
+# How long a nextCursor stays valid; an expired cursor re-ranks and continues at its offset
+RECOMMENDATION_CURSOR_TTL = int(os.getenv('RECOMMENDATION_CURSOR_TTL', '600'))  # seconds
+
 # Chroma DB Path
 CHROMA_DB_DIR = os.path.join(BASE_DIR, 'chroma_db')
 
+# Rule engine: 'prolog' runs ai_engine/recommendation.pl through SWI-Prolog;
+# 'numpy' evaluates the same rules in-process (no SWI-Prolog needed). Check
+# they agree with `manage.py compare_reasoners`.
+RECOMMENDER_REASONING_BACKEND = os.getenv('RECOMMENDER_REASONING_BACKEND', 'prolog')
+# Users whose similar-to-liked candidate sets are kept in memory (LRU)
+SIMILAR_TO_LIKED_CACHE_USERS = int(os.getenv('SIMILAR_TO_LIKED_CACHE_USERS', '1000'))
+# How far back each incremental KB load re-reads movies and likes before its
+# high-water mark: a row stamped before one that committed ahead of it (a sync
+# writing in parallel, concurrent swipes) is still picked up.
+KB_RELOAD_OVERLAP_SECONDS = float(os.getenv('KB_RELOAD_OVERLAP_SECONDS', '60'))
+
+# Prolog engines: 'inline' = one engine in this process, queries serialised
+# behind a lock; 'process' = PROLOG_POOL_SIZE worker processes (default: CPU
+# count), each with a full copy of the KB, for threaded/ASGI servers.
+PROLOG_POOL_MODE = os.getenv('PROLOG_POOL_MODE', 'inline')
+PROLOG_POOL_SIZE = int(os.getenv('PROLOG_POOL_SIZE', '0')) or None
+
+# TMDB sync: requests per period shared by all sync threads (TMDB's documented
+# budget is 40 per 10 s), and how many pages/credits are fetched at once.
+TMDB_API_URL = os.getenv('TMDB_API_URL', 'https://api.themoviedb.org/3')
+TMDB_RATE_LIMIT = int(os.getenv('TMDB_RATE_LIMIT', '40'))
+TMDB_RATE_PERIOD = float(os.getenv('TMDB_RATE_PERIOD', '10'))  # seconds
+TMDB_MAX_WORKERS = int(os.getenv('TMDB_MAX_WORKERS', '8'))
+
+# Sync pipeline: pages buffered between stages, and where an interrupted crawl
+# records its position for `fetch_movies --resume`.
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', '4'))
+INGEST_CHECKPOINT_PATH = os.getenv('INGEST_CHECKPOINT_PATH', os.path.join(BASE_DIR, 'ingest_checkpoint.json'))
+
+# Embedding backend: 'openrouter' (remote API, OPENROUTER_* env vars) or 'local'
+# (sentence-transformers on CPU; ONNX runtime when optimum[onnxruntime] is installed).
+# Switching backends changes the vector size: rebuild with `manage.py backfill_chroma --reset`.
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'openrouter')
+EMBEDDING_LOCAL_MODEL = os.getenv('EMBEDDING_LOCAL_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+EMBEDDING_LOCAL_ONNX = os.getenv('EMBEDDING_LOCAL_ONNX', 'True').lower() in ('true', '1', 't')
+EMBEDDING_LOCAL_THREADS = int(os.getenv('EMBEDDING_LOCAL_THREADS', '0'))  # 0 = library default
+EMBEDDING_LOCAL_BATCH_SIZE = int(os.getenv('EMBEDDING_LOCAL_BATCH_SIZE', '32'))
+
+# Embedding cache: in-process LRU in front of a SQLite file, keyed by model + text hash
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', os.path.join(BASE_DIR, 'embedding_cache.sqlite3'))
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv('EMBEDDING_CACHE_MEMORY_ITEMS', '2048'))
+
+# Semantic search index: 'exact' scans every vector, 'ivf' is approximate
+# (k-means cells) and only worth it once the catalogue reaches tens of thousands.
+VECTOR_INDEX_TYPE = os.getenv('VECTOR_INDEX_TYPE', 'exact')
+VECTOR_IVF_NLIST = int(os.getenv('VECTOR_IVF_NLIST', '0')) or None  # default: sqrt(catalogue size)
+VECTOR_IVF_NPROBE = int(os.getenv('VECTOR_IVF_NPROBE', '8'))
+# In-memory precision of the searchable matrix: 'float32', 'float16' (2x smaller)
+# or 'int8' (4x smaller). Compressed modes re-rank the best VECTOR_RERANK hits at
+# full precision from disk; they trade scan speed for memory, so pair them with 'ivf'.
+VECTOR_STORAGE_DTYPE = os.getenv('VECTOR_STORAGE_DTYPE', 'float32')
+VECTOR_RERANK = int(os.getenv('VECTOR_RERANK', '200'))
+
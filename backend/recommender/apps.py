@@ -15,3 +15,9 @@ class RecommenderConfig(AppConfig):
             load_prolog_kb()
         except Exception as e:
             print(f"Failed to auto-load Prolog KB: {e}")
+
+        try:
+            from .services import get_chroma_collection
+            get_chroma_collection()
+        except Exception as e:
+            print(f"Failed to load vector index: {e}")
@@ -0,0 +1,75 @@
+import threading
+
+import numpy as np
+
+TMDB_GENRES = {
+    28: 'action', 12: 'adventure', 16: 'animation', 35: 'comedy', 80: 'crime',
+    99: 'documentary', 18: 'drama', 10751: 'family', 14: 'fantasy', 36: 'history',
+    27: 'horror', 10402: 'musical', 9648: 'mystery', 10749: 'romance', 878: 'sci-fi',
+    10770: 'tv movie', 53: 'thriller', 10752: 'war', 37: 'western'
+}
+
+# Every mood tasks.infer_mood can produce
+MOODS = ('dark', 'funny', 'mind-bending', 'action-packed', 'thrilling', 'romantic',
+         'heartwarming', 'thought-provoking', 'tense')
+
+
+class Vocabulary:
+    """
+    Value -> bit position. The known values get fixed bits (so a mask means the
+    same thing in every process); anything else seen in the data is appended
+    after them on first use, so no value is ever dropped.
+    """
+
+    def __init__(self, values):
+        self._bits = {}
+        for value in values:
+            self._bits.setdefault(value, len(self._bits))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._bits)
+
+    @property
+    def words(self):
+        return max(1, (len(self._bits) + 63) // 64)
+
+    def bit(self, value, add=False):
+        bit = self._bits.get(value)
+        if bit is None and add:
+            with self._lock:
+                bit = self._bits.setdefault(value, len(self._bits))
+        return bit
+
+    def mask(self, values, add=True):
+        """Python int with one bit set per value."""
+        mask = 0
+        for value in values:
+            bit = self.bit(value, add=add)
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+
+GENRE_VOCAB = Vocabulary(TMDB_GENRES.values())
+MOOD_VOCAB = Vocabulary(MOODS)
+
+
+def pack(masks, words):
+    """Python int masks -> (n, words) uint64 array."""
+    out = np.zeros((len(masks), words), dtype=np.uint64)
+    low = (1 << 64) - 1
+    for word in range(words):
+        shift = 64 * word
+        out[:, word] = np.fromiter(((m >> shift) & low for m in masks), dtype=np.uint64, count=len(masks))
+    return out
+
+def has_bit(bits, bit):
+    """Rows of a packed array with ``bit`` set (all False for an unknown value)."""
+    if bit is None or bit // 64 >= bits.shape[1]:
+        return np.zeros(len(bits), dtype=bool)
+    return (bits[:, bit // 64] & np.uint64(1 << (bit % 64))) != 0
+
+def overlap(bits, mask_words):
+    """Per-row popcount(bits & mask): how many of the mask's values each row shares."""
+    return np.bitwise_count(bits & mask_words).sum(axis=1)
@@ -0,0 +1,66 @@
+import threading
+
+
+class MovieRecord:
+    """The fields a recommendation card shows, for one movie."""
+
+    __slots__ = ('tmdb_id', 'title', 'overview', 'poster_url', 'release_year', 'rating', 'popularity', 'cast')
+
+    def __init__(self, tmdb_id, title, overview, poster_url, release_year, rating, popularity, cast):
+        self.tmdb_id = tmdb_id
+        self.title = title
+        self.overview = overview
+        self.poster_url = poster_url
+        self.release_year = release_year
+        self.rating = rating
+        self.popularity = popularity
+        self.cast = cast
+
+    def as_recommendation(self, explanation):
+        return {
+            "title": self.title,
+            "explanation": explanation,
+            "popularity": self.popularity,
+            "poster_url": self.poster_url,
+            "overview": self.overview,
+            "cast": self.cast,
+            "rating": self.rating,
+            "year": self.release_year,
+            "tmdb_id": self.tmdb_id,
+        }
+
+
+# Movie columns a MovieRecord is built from, in constructor order
+RECORD_FIELDS = MovieRecord.__slots__
+
+
+class MovieCatalogue:
+    """
+    In-process tmdb_id -> MovieRecord map, kept in step with the reasoner's KB
+    by services.load_prolog_kb. Read-mostly: lookups take no lock, updates
+    swap whole records under one.
+    """
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, tmdb_id):
+        return tmdb_id in self._records
+
+    def upsert(self, rows):
+        """rows: tuples in RECORD_FIELDS order."""
+        records = [MovieRecord(*row) for row in rows]
+        with self._lock:
+            for record in records:
+                self._records[record.tmdb_id] = record
+
+    def get(self, tmdb_id):
+        return self._records.get(tmdb_id)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
@@ -0,0 +1,336 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache keyed by sha256(model + text): a bounded
+    in-process LRU in front of a SQLite file shared by every worker and the
+    Celery sync. Vectors are stored as float32 blobs.
+    """
+
+    def __init__(self, path, max_memory_items=2048):
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model, text):
+        return hashlib.sha256(f"{model}\0{text}".encode('utf-8')).hexdigest()
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            # WAL lets web workers read while a sync is writing.
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, model, text):
+        key = self.key(model, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector.tolist()
+            try:
+                row = self._db().execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                print(f"Embedding cache read failed: {e}")
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            vector = np.frombuffer(row[0], dtype=np.float32)
+            self._remember(key, vector)
+            self.disk_hits += 1
+            return vector.tolist()
+
+    def put(self, model, text, embedding):
+        key = self.key(model, text)
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            try:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, model, vector, created) VALUES (?, ?, ?, ?)",
+                    (key, model, vector.tobytes(), time.time())
+                )
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"Embedding cache write failed: {e}")
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+        }
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache():
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(
+                getattr(settings, 'EMBEDDING_CACHE_PATH', os.path.join(settings.BASE_DIR, 'embedding_cache.sqlite3')),
+                max_memory_items=getattr(settings, 'EMBEDDING_CACHE_MEMORY_ITEMS', 2048),
+            )
+        return _embedding_cache
+
+
+OPENROUTER_EMBEDDINGS_URL = "https://openrouter.ai/api/v1/embeddings"
+
+_http_session = None
+
+def _session():
+    # One pooled session so batch requests reuse their TLS connections.
+    global _http_session
+    if _http_session is None:
+        import requests
+        _http_session = requests.Session()
+    return _http_session
+
+
+class OpenRouterEmbeddingBackend:
+    """Remote embeddings from OpenRouter's OpenAI-compatible endpoint."""
+
+    max_concurrency = 4
+    batch_size = 64
+
+    def __init__(self, model=None, api_key=None):
+        self.model = model or os.getenv("OPENROUTER_EMBEDDING_MODEL", "nomic-ai/nomic-embed-text-v1.5")
+        self.api_key = api_key if api_key is not None else os.getenv("OPENROUTER_API_KEY")
+        self.cache_namespace = self.model
+
+    def available(self):
+        if not self.api_key:
+            print("OPENROUTER_API_KEY not found in environment variables.")
+            return False
+        return True
+
+    def embed(self, texts, timeout=10):
+        """One POST for a list of texts. Returns a list aligned with ``texts`` (None where missing)."""
+        response = _session().post(
+            OPENROUTER_EMBEDDINGS_URL,
+            headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
+            json={"model": self.model, "input": texts if len(texts) > 1 else texts[0]},
+            timeout=timeout
+        )
+        if not response.ok:
+            print(f"OpenRouter API Error: {response.status_code} - {response.text}")
+        response.raise_for_status()
+        data = response.json() or {}
+        results = [None] * len(texts)
+        for position, item in enumerate(data.get("data") or []):
+            index = item.get("index", position)
+            if 0 <= index < len(texts) and item.get("embedding"):
+                results[index] = item["embedding"]
+        return results
+
+    def retryable(self, error):
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+        # Bad key / no credits / bad input: retrying won't help
+        return not (status_code and 400 <= status_code < 500 and status_code != 429)
+
+
+class LocalEmbeddingBackend:
+    """
+    CPU-local sentence-transformers model, so semantic search works offline
+    and without per-query HTTP latency. The model is loaded on first use with
+    the ONNX runtime when available (needs optimum[onnxruntime]), otherwise
+    with torch. ``threads`` caps intra-op threads (0 = library default).
+    """
+
+    max_concurrency = 1  # the model already parallelises each batch internally
+
+    def __init__(self, model="sentence-transformers/all-MiniLM-L6-v2", use_onnx=True, threads=0, batch_size=32):
+        self.model = model
+        self.use_onnx = use_onnx
+        self.threads = threads
+        self.batch_size = batch_size
+        self.cache_namespace = f"local:{model}"
+        self._encoder = None
+        self._load_lock = threading.Lock()
+
+    def available(self):
+        return True
+
+    def _load(self):
+        with self._load_lock:
+            if self._encoder is not None:
+                return self._encoder
+            from sentence_transformers import SentenceTransformer
+            started = time.time()
+            if self.use_onnx:
+                try:
+                    model_kwargs = {"provider": "CPUExecutionProvider"}
+                    if self.threads:
+                        import onnxruntime
+                        options = onnxruntime.SessionOptions()
+                        options.intra_op_num_threads = self.threads
+                        model_kwargs["session_options"] = options
+                    self._encoder = SentenceTransformer(self.model, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+                except Exception as e:
+                    print(f"ONNX runtime unavailable for {self.model} ({e}); falling back to torch.")
+            if self._encoder is None:
+                if self.threads:
+                    import torch
+                    torch.set_num_threads(self.threads)
+                self._encoder = SentenceTransformer(self.model, device="cpu")
+            print(f"Loaded local embedding model {self.model} in {time.time() - started:.1f}s")
+            return self._encoder
+
+    def embed(self, texts, timeout=None):
+        encoder = self._load()
+        vectors = encoder.encode(texts, batch_size=self.batch_size, convert_to_numpy=True, normalize_embeddings=True)
+        return [v.tolist() for v in vectors]
+
+    def retryable(self, error):
+        return False
+
+
+_embedding_backend = None
+_embedding_backend_lock = threading.Lock()
+
+def get_embedding_backend():
+    """The process-wide embedding backend selected by settings.EMBEDDING_BACKEND."""
+    global _embedding_backend
+    with _embedding_backend_lock:
+        if _embedding_backend is None:
+            name = getattr(settings, 'EMBEDDING_BACKEND', 'openrouter')
+            if name == 'local':
+                _embedding_backend = LocalEmbeddingBackend(
+                    model=getattr(settings, 'EMBEDDING_LOCAL_MODEL', "sentence-transformers/all-MiniLM-L6-v2"),
+                    use_onnx=getattr(settings, 'EMBEDDING_LOCAL_ONNX', True),
+                    threads=getattr(settings, 'EMBEDDING_LOCAL_THREADS', 0),
+                    batch_size=getattr(settings, 'EMBEDDING_LOCAL_BATCH_SIZE', 32),
+                )
+            elif name == 'openrouter':
+                _embedding_backend = OpenRouterEmbeddingBackend()
+            else:
+                raise ValueError(f"Unknown EMBEDDING_BACKEND {name!r}")
+        return _embedding_backend
+
+
+def movie_embedding_text(title, genres, cast, overview):
+    """The text a movie is embedded from; keep it identical everywhere so cache keys match."""
+    return f"Title: {title}. Genres: {', '.join(genres)}. Cast: {', '.join(cast)}. Overview: {overview}"
+
+
+def _embed_one(backend, text):
+    cache = get_embedding_cache()
+    cached = cache.get(backend.cache_namespace, text)
+    if cached is not None:
+        return cached
+    if not backend.available():
+        return None
+    try:
+        embedding = backend.embed([text])[0]
+        if embedding:
+            cache.put(backend.cache_namespace, text, embedding)
+        return embedding
+    except Exception as e:
+        print(f"Exception computing embedding with {backend.cache_namespace}: {e}")
+        return None
+
+
+def embed_text(text):
+    """Embed one text (e.g. a search query) with the configured backend, via the cache."""
+    return _embed_one(get_embedding_backend(), text)
+
+
+def get_openrouter_embedding(text):
+    """Embed one text with OpenRouter regardless of EMBEDDING_BACKEND."""
+    return _embed_one(OpenRouterEmbeddingBackend(), text)
+
+
+def embed_many(texts, batch_size=None, max_workers=None, max_retries=3, backoff=1.0):
+    """
+    Embed many texts with as few round trips as possible.
+
+    Cached texts are answered locally; the rest are sent ``batch_size`` per
+    request with at most ``max_workers`` requests in flight (default: the
+    backend's ``max_concurrency``). A batch that
+    fails, or comes back with some items missing, has just the missing texts
+    retried with exponential backoff. Returns a list aligned with ``texts``;
+    entries that still failed after ``max_retries`` are None.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    backend = get_embedding_backend()
+    batch_size = batch_size or backend.batch_size
+    max_workers = max_workers or backend.max_concurrency
+    cache = get_embedding_cache()
+
+    results = [None] * len(texts)
+    pending = {}  # text -> positions in `texts` (duplicates are embedded once)
+    for i, text in enumerate(texts):
+        cached = cache.get(backend.cache_namespace, text)
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.setdefault(text, []).append(i)
+
+    if not pending or not backend.available():
+        return results
+
+    def run_batch(batch):
+        remaining = list(batch)
+        for attempt in range(max_retries + 1):
+            if attempt:
+                time.sleep(backoff * (2 ** (attempt - 1)))
+            try:
+                embeddings = backend.embed(remaining, timeout=60)
+            except Exception as e:
+                print(f"Embedding batch of {len(remaining)} failed (attempt {attempt + 1}/{max_retries + 1}): {e}")
+                if not backend.retryable(e):
+                    break
+                continue
+            missing = []
+            for text, embedding in zip(remaining, embeddings):
+                if embedding:
+                    cache.put(backend.cache_namespace, text, embedding)
+                    for i in pending[text]:
+                        results[i] = embedding
+                else:
+                    missing.append(text)
+            remaining = missing
+            if not remaining:
+                return
+        print(f"Giving up on embedding {len(remaining)} texts.")
+
+    unique = list(pending)
+    batches = [unique[i:i + batch_size] for i in range(0, len(unique), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as pool:
+        list(pool.map(run_batch, batches))
+    return results
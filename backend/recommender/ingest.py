@@ -0,0 +1,265 @@
+import json
+import os
+import queue
+import threading
+import time
+
+_DONE = object()  # end-of-stream marker passed down the stages
+
+
+class StageCounter:
+    """Movies a stage has handled and the time it spent busy on them."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.seconds = 0.0
+        self.errors = 0
+
+    @property
+    def rate(self):
+        return self.items / self.seconds if self.seconds else 0.0
+
+
+class Checkpoint:
+    """
+    Crawl position persisted as JSON: the last page such that it and every
+    page before it is stored in the DB, plus the tmdb_ids stored but not yet
+    in the vector index. Written after every page, atomically.
+    """
+
+    def __init__(self, path, last_page=0, pending=()):
+        self.path = path
+        self.last_page = last_page
+        self.pending = set(pending)
+        self._stored_pages = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            return cls(path, data.get("last_page", 0), data.get("pending_embeddings", []))
+        except FileNotFoundError:
+            return cls(path)
+
+    def page_stored(self, page, tmdb_ids):
+        with self._lock:
+            self._stored_pages.add(page)
+            while self.last_page + 1 in self._stored_pages:
+                self.last_page += 1
+            self.pending.update(tmdb_ids)
+            self._save()
+
+    def embedded(self, tmdb_ids):
+        with self._lock:
+            self.pending.difference_update(tmdb_ids)
+            self._save()
+
+    def _save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"last_page": self.last_page, "pending_embeddings": sorted(self.pending)}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class IngestPipeline:
+    """
+    TMDB sync as stages on their own threads, joined by bounded queues so
+    a slow stage throttles the ones before it instead of buffering the crawl:
+
+        fetch pages -> delta -> fetch credits -> classify -> DB write -> embed -> vector upsert
+
+    Each item is one page. With ``delta``, movies whose fingerprint matches
+    the stored row and that already have a vector stop at the delta stage
+    (only popularity/rating are refreshed), so they cost no credits request,
+    DB upsert or embedding.
+    The checkpoint advances after the DB write and loses the page's ids
+    again once their vectors are stored.
+    """
+
+    STAGES = ("fetch", "delta", "credits", "classify", "store", "embed", "index")
+
+    def __init__(self, client, checkpoint, collection=None, queue_size=4, delta=True):
+        self.client = client
+        self.checkpoint = checkpoint
+        self.collection = collection
+        self.queue_size = queue_size
+        self.counters = {name: StageCounter(name) for name in self.STAGES}
+        self.embedding_disabled = False  # Circuit breaker: stop trying embeddings after first failure
+        self.delta = delta
+        self.unchanged = 0
+        self.refreshed = 0
+
+    def run(self, pages):
+        """Ingest ``pages`` (in order); returns the number of movies written to the DB."""
+        steps = [self._fetch, self._delta, self._credits, self._classify, self._store, self._embed, self._index]
+        if self.collection is None:
+            steps = steps[:5]  # nothing to embed into: the pipeline ends at the DB write
+        names = self.STAGES[:len(steps)]
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in steps[1:]]
+        inboxes = [None] + queues
+        outboxes = queues + [None]
+        initial = {"embed": self._resume_batches()}
+
+        threads = []
+        for name, step, inbox, outbox in zip(names, steps, inboxes, outboxes):
+            source = iter(pages) if inbox is None else None
+            thread = threading.Thread(target=self._stage, args=(name, step, source, inbox, outbox, initial.get(name, ())),
+                                      name=f"ingest-{name}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return self.counters["store"].items
+
+    def _stage(self, name, step, source, inbox, outbox, initial):
+        counter = self.counters[name]
+
+        def handle(item):
+            started = time.perf_counter()
+            try:
+                result = step(item)
+            except Exception as e:
+                counter.errors += 1
+                page = item if isinstance(item, int) else item[0]
+                print(f"Ingest stage '{name}' failed on page {page}: {e}")
+                result = None
+            counter.seconds += time.perf_counter() - started
+            if result is not None:
+                counter.items += len(result[1])
+                if outbox is not None:
+                    outbox.put(result)
+
+        for item in initial:
+            handle(item)
+        while True:
+            item = next(source, _DONE) if source is not None else inbox.get()
+            if item is _DONE:
+                break
+            handle(item)
+        if outbox is not None:
+            outbox.put(_DONE)
+        from django.db import connection
+        connection.close()  # this thread's own DB connection
+
+    # ── Stages: each takes one page's item and returns (page, movies) or None ──
+
+    def _fetch(self, page):
+        movies = [
+            m for m in self.client.popular_page(page)
+            if m.get("poster_path") and m.get("title", "").lower() not in ["the orphans", "orphans"]
+        ]
+        return page, movies
+
+    def _delta(self, item):
+        from .models import Movie
+        from .tasks import tmdb_fingerprint, volatile_values, bulk_update_movies, VOLATILE_FIELDS
+        page, movies = item
+        if not self.delta or not movies:
+            return page, movies
+        stored = {
+            row[0]: row for row in Movie.objects.filter(tmdb_id__in=[m["id"] for m in movies]).values_list(
+                'tmdb_id', 'pk', 'fingerprint', *VOLATILE_FIELDS)
+        }
+        changed = []
+        volatile = []
+        for m in movies:
+            row = stored.get(m["id"])
+            if row is None or not row[2] or row[2] != tmdb_fingerprint(m) or not self._indexed(m["id"]):
+                changed.append(m)
+                continue
+            values = volatile_values(m)
+            if [values[f] for f in VOLATILE_FIELDS] != list(row[3:]):
+                volatile.append(Movie(pk=row[1], **values))
+        if volatile:
+            bulk_update_movies(volatile, VOLATILE_FIELDS)
+        self.unchanged += len(movies) - len(changed)
+        self.refreshed += len(volatile)
+        return page, changed
+
+    def _indexed(self, tmdb_id):
+        # A movie stored while embeddings were failing still needs its vector
+        return self.collection is None or self.collection.has(tmdb_id)
+
+    def _credits(self, item):
+        page, movies = item
+        casts = self.client.casts([m["id"] for m in movies])
+        # A movie whose credits failed keeps its stored version until the next sync
+        return page, [(m, casts[m["id"]]) for m in movies if m["id"] in casts]
+
+    def _classify(self, item):
+        from .tasks import movie_defaults
+        page, pairs = item
+        return page, {m["id"]: movie_defaults(m, cast) for m, cast in pairs}
+
+    def _store(self, item):
+        from .tasks import upsert_movies
+        page, rows = item
+        upsert_movies(rows)
+        if self.collection is None:
+            self.checkpoint.page_stored(page, ())
+            return page, list(rows)
+        self.checkpoint.page_stored(page, rows)
+        return page, [self._vector(tmdb_id, d['title'], d['genres'], d['cast'], d['overview'], d['min_age'], d['moods'])
+                      for tmdb_id, d in rows.items()]
+
+    def _embed(self, item):
+        from .embeddings import embed_many
+        page, vectors = item
+        if self.embedding_disabled or not vectors:
+            return page, []
+        embeddings = embed_many([text for _, text, _ in vectors])
+        done = [(v, e) for v, e in zip(vectors, embeddings) if e]
+        if not done:
+            # Embedding failed (likely 401/no credits): stop wasting API calls.
+            # The ids stay pending in the checkpoint for a later --resume or backfill_chroma.
+            self.embedding_disabled = True
+            print("⚠️  Embedding failed. Disabling embeddings for the rest of this sync.")
+            print("   (Movies will still be saved to the database. Local keyword search will work.)")
+        return page, done
+
+    def _index(self, item):
+        page, done = item
+        if done:
+            self.collection.upsert(
+                documents=[text for (_, text, _), _ in done],
+                embeddings=[e for _, e in done],
+                metadatas=[meta for (_, _, meta), _ in done],
+                ids=[str(movie_id) for (movie_id, _, _), _ in done]
+            )
+            self.checkpoint.embedded([movie_id for (movie_id, _, _), _ in done])
+        return page, done
+
+    # ── Resume ──
+
+    @staticmethod
+    def _vector(tmdb_id, title, genres, cast, overview, min_age, moods):
+        from .embeddings import movie_embedding_text
+        from .services import vector_metadata
+        return tmdb_id, movie_embedding_text(title, genres, cast, overview), vector_metadata(tmdb_id, title, min_age, genres, moods)
+
+    def _resume_batches(self, batch_size=20):
+        """Movies an interrupted run stored but never indexed, as embed-stage items."""
+        from .models import Movie
+        if self.collection is None or not self.checkpoint.pending:
+            return []
+        rows = Movie.objects.filter(tmdb_id__in=self.checkpoint.pending).values_list(
+            'tmdb_id', 'title', 'genres', 'cast', 'overview', 'min_age', 'moods')
+        vectors = [self._vector(*row) for row in rows]
+        print(f"Resuming {len(vectors)} pending embeddings from the last run.")
+        return [("pending", vectors[i:i + batch_size]) for i in range(0, len(vectors), batch_size)]
+
+    def report(self):
+        lines = [f"{'stage':<10}{'movies':>8}{'busy s':>9}{'movies/s':>10}{'errors':>8}"]
+        for c in self.counters.values():
+            if not c.items and not c.seconds:
+                continue
+            lines.append(f"{c.name:<10}{c.items:>8}{c.seconds:>9.2f}{c.rate:>10.1f}{c.errors:>8}")
+        return "\n".join(lines)
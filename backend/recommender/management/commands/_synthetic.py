@@ -0,0 +1,15 @@
+from recommender.reasoning import movie_fact
+
+GENRES = ['action', 'comedy', 'drama', 'horror', 'romance', 'sci-fi', 'thriller', 'animation']
+MOODS = ['action-packed', 'funny', 'emotional', 'scary', 'romantic', 'mind-bending', 'suspenseful']
+# Synthetic ids start here so they never collide with real TMDB ids in the KB
+ID_OFFSET = 900000000
+
+
+def synthetic_movie_facts(rng, count, title="Benchmark Movie {i}"):
+    """movie/7 facts for ``count`` random movies with ids from ID_OFFSET, for the benchmark commands."""
+    return [
+        movie_fact(ID_OFFSET + i, title.format(i=i), rng.sample(GENRES, 2), rng.sample(MOODS, 2),
+                   rng.choice([0, 7, 13, 17, 18]), rng.randint(1970, 2025), rng.uniform(1, 500))
+        for i in range(count)
+    ]
@@ -1,37 +1,68 @@
 from django.core.management.base import BaseCommand
 from recommender.models import Movie
-from recommender.services import get_openrouter_embedding, get_chroma_collection
+from recommender.services import get_chroma_collection, vector_metadata
+from recommender.embeddings import embed_many, movie_embedding_text
 
 class Command(BaseCommand):
     help = 'Backfills ChromaDB with existing movies in the SQLite database'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Texts per embeddings request (default: per backend)')
+        parser.add_argument('--workers', type=int, default=None, help='Embedding requests in flight at once (default: per backend, 4 for OpenRouter, 1 for local)')
+        parser.add_argument('--reset', action='store_true',
+                            help='Rebuild the store from scratch (needed after switching EMBEDDING_BACKEND, which changes the vector size)')
+
+    def handle(self, *args, **options):
         self.stdout.write("Initializing ChromaDB...")
         collection = get_chroma_collection()
         if not collection:
             self.stdout.write(self.style.ERROR("Could not initialize ChromaDB"))
             return
-            
-        movies = Movie.objects.all()
-        count = movies.count()
+
+        movies = list(Movie.objects.all())
+        count = len(movies)
         self.stdout.write(f"Found {count} movies in database to sync to Chroma DB...")
-        
+
+        texts = [movie_embedding_text(m.title, m.genres, m.cast, m.overview) for m in movies]
+        embeddings = embed_many(texts, batch_size=options['batch_size'], max_workers=options['workers'])
+
+        dims = {len(e) for e in embeddings if e}
+        if options['reset']:
+            done = [(m, text, e) for m, text, e in zip(movies, texts, embeddings) if e]
+            for m, _, e in zip(movies, texts, embeddings):
+                if not e:
+                    self.stdout.write(self.style.WARNING(f"Failed to generate embedding for {m.title}"))
+            if not done:
+                self.stdout.write(self.style.ERROR("No embeddings generated; leaving the existing store untouched."))
+                return
+            # Embedded first, replaced in one snapshot: a failed run never empties the store
+            collection.rebuild(
+                documents=[text for _, text, _ in done],
+                embeddings=[e for _, _, e in done],
+                metadatas=[vector_metadata(m.tmdb_id, m.title, m.min_age, m.genres, m.moods) for m, _, _ in done],
+                ids=[str(m.tmdb_id) for m, _, _ in done]
+            )
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt Chroma DB with {len(done)} movies ({collection.dim} dims)."))
+            return
+        if collection.dim and dims and dims != {collection.dim}:
+            self.stdout.write(self.style.ERROR(
+                f"The store holds {collection.dim}-dim vectors but the current EMBEDDING_BACKEND produces "
+                f"{', '.join(map(str, sorted(dims)))}-dim ones. Re-run with --reset to rebuild it."))
+            return
+
         success_count = 0
-        for m in movies:
-            text_for_embedding = f"Title: {m.title}. Genres: {', '.join(m.genres)}. Cast: {', '.join(m.cast)}. Overview: {m.overview}"
-            embedding = get_openrouter_embedding(text_for_embedding)
-            
-            if embedding:
-                collection.upsert(
-                    documents=[text_for_embedding],
-                    embeddings=[embedding],
-                    metadatas=[{"tmdb_id": m.tmdb_id, "title": m.title}],
-                    ids=[str(m.tmdb_id)]
-                )
-                success_count += 1
-                if success_count % 10 == 0:
-                    self.stdout.write(self.style.SUCCESS(f"Synced {success_count}/{count} movies..."))
-            else:
-                self.stdout.write(self.style.WARNING(f"Failed to generate embedding for {m.title}"))
-                
+        # One batch: the index is appended to once, after the whole loop
+        with collection.batch():
+            for m, text_for_embedding, embedding in zip(movies, texts, embeddings):
+                if embedding:
+                    collection.upsert(
+                        documents=[text_for_embedding],
+                        embeddings=[embedding],
+                        metadatas=[vector_metadata(m.tmdb_id, m.title, m.min_age, m.genres, m.moods)],
+                        ids=[str(m.tmdb_id)]
+                    )
+                    success_count += 1
+                else:
+                    self.stdout.write(self.style.WARNING(f"Failed to generate embedding for {m.title}"))
+
         self.stdout.write(self.style.SUCCESS(f"Finished backfilling {success_count} movies into Chroma DB!"))
@@ -0,0 +1,50 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from recommender.services import prolog
+from recommender.reasoning import assert_facts
+from recommender.management.commands._synthetic import ID_OFFSET, synthetic_movie_facts
+
+
+class Command(BaseCommand):
+    help = 'Times a cold Prolog KB load with per-fact assertz versus the bulk fact-file loader'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=10000, help='Synthetic movie/7 facts')
+        parser.add_argument('--likes', type=int, default=100000, help='Synthetic user_likes/2 facts')
+        parser.add_argument('--users', type=int, default=1000, help='Distinct users the likes are spread over')
+        parser.add_argument('--skip-assertz', action='store_true', help='Only time the bulk loader')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        movie_facts = synthetic_movie_facts(rng, options['movies'], title="Benchmark Movie {i}: The 'Sequel'")
+        like_facts = list(dict.fromkeys(
+            f"user_likes({ID_OFFSET + rng.randrange(options['users'])}, {ID_OFFSET + rng.randrange(options['movies'])})"
+            for _ in range(options['likes'])
+        ))
+        self.stdout.write(f"{len(movie_facts)} movie facts, {len(like_facts)} distinct like facts")
+
+        if not options['skip_assertz']:
+            # One FFI round trip per fact
+            start = time.perf_counter()
+            assert_facts(prolog, movie_facts, bulk=False)
+            assert_facts(prolog, like_facts, bulk=False)
+            self._report('per-fact assertz', start)
+            self._cleanup()
+
+        start = time.perf_counter()
+        assert_facts(prolog, movie_facts, bulk=True)
+        assert_facts(prolog, like_facts, bulk=True)
+        self._report('bulk fact file', start)
+        self._cleanup()
+
+    def _report(self, label, start):
+        elapsed = time.perf_counter() - start
+        movies = list(prolog.query(f"aggregate_all(count, (movie(ID, _, _, _, _, _, _), ID >= {ID_OFFSET}), N)"))[0]["N"]
+        likes = list(prolog.query(f"aggregate_all(count, (user_likes(U, _), U >= {ID_OFFSET}), N)"))[0]["N"]
+        self.stdout.write(f"{label:<20}{elapsed:>8.2f}s  ({movies} movies, {likes} likes asserted)")
+
+    def _cleanup(self):
+        prolog.write(f"forall((movie(ID, _, _, _, _, _, _), ID >= {ID_OFFSET}), remove_movie(ID))")
+        prolog.write(f"forall((user_likes(U, _), U >= {ID_OFFSET}), retractall(user_likes(U, _)))")
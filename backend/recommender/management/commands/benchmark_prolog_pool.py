@@ -0,0 +1,48 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from recommender.prolog_pool import PrologEnginePool
+from recommender.services import normalized_path
+from recommender.reasoning import assert_facts
+from recommender.management.commands._synthetic import GENRES, MOODS, ID_OFFSET, synthetic_movie_facts
+
+
+class Command(BaseCommand):
+    help = 'Load-tests recommendation queries from concurrent threads against inline and process Prolog pools'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=10000, help='Synthetic movie/7 facts in each KB')
+        parser.add_argument('--requests', type=int, default=400, help='Queries per run')
+        parser.add_argument('--threads', type=str, default='1,2,4,8', help='Comma-separated request thread counts')
+        parser.add_argument('--modes', type=str, default='inline,process', help='Pool modes to compare')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        facts = synthetic_movie_facts(rng, options['movies'])
+        goals = [
+            f"recommend_movie_relaxed('{rng.choice(GENRES + ['any'])}', '{rng.choice(MOODS + ['any'])}', "
+            f"{rng.choice([10, 16, 30])}, Tier, ID, Title, Explanation, Popularity)"
+            for _ in range(options['requests'])
+        ]
+
+        self.stdout.write(f"{'mode':<10}{'threads':>8}{'req/s':>10}{'speedup':>10}")
+        for mode in [m.strip() for m in options['modes'].split(',') if m.strip()]:
+            baseline = None
+            for threads in [int(t) for t in options['threads'].split(',') if t.strip()]:
+                # One worker process per request thread in process mode
+                pool = PrologEnginePool(normalized_path, mode=mode, size=threads)
+                try:
+                    assert_facts(pool, facts, bulk=True)
+                    pool.query(goals[0])  # warm up outside the timing
+                    start = time.perf_counter()
+                    with ThreadPoolExecutor(max_workers=threads) as executor:
+                        list(executor.map(pool.query, goals))
+                    rate = len(goals) / (time.perf_counter() - start)
+                finally:
+                    # The inline engine is process-wide: drop the synthetic movies again
+                    pool.write(f"forall((movie(ID, _, _, _, _, _, _), ID >= {ID_OFFSET}), remove_movie(ID))")
+                    pool.close()
+                baseline = baseline or rate
+                self.stdout.write(f"{mode:<10}{threads:>8}{rate:>10.1f}{rate / baseline:>10.1f}")
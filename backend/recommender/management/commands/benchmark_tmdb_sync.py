@@ -0,0 +1,169 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from recommender.ingest import Checkpoint, IngestPipeline
+from recommender.tmdb import TMDBClient, TokenBucket
+
+MOVIES_PER_PAGE = 20
+
+
+class StubTMDB:
+    """
+    Local stand-in for the two TMDB endpoints the sync uses, with a fixed
+    per-request latency. It answers 429 (with Retry-After) whenever a request
+    would exceed ``limit`` requests in any ``period`` seconds, like TMDB.
+    """
+
+    def __init__(self, latency, limit, period):
+        self.latency = latency
+        self.limit = limit
+        self.period = period
+        self.requests = []  # monotonic arrival time of every request served
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/3"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.requests = []
+            self.rejected = 0
+
+    def max_in_window(self):
+        """Most requests served in any ``period``-second window."""
+        times = sorted(self.requests)
+        best = start = 0
+        for end, t in enumerate(times):
+            while t - times[start] >= self.period:
+                start += 1
+            best = max(best, end - start + 1)
+        return best
+
+    def _admit(self):
+        now = time.monotonic()
+        with self._lock:
+            recent = [t for t in self.requests[-self.limit:] if now - t < self.period]
+            if len(recent) >= self.limit:
+                self.rejected += 1
+                return False
+            self.requests.append(now)
+            return True
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if not stub._admit():
+                    self.send_response(429)
+                    self.send_header("Retry-After", str(stub.period / stub.limit))
+                    self.end_headers()
+                    return
+                time.sleep(stub.latency)
+                credits = re.fullmatch(r"/3/movie/(\d+)/credits", url.path)
+                if url.path == "/3/movie/popular":
+                    page = int(parse_qs(url.query).get("page", ["1"])[0])
+                    body = {"page": page, "results": [stub.movie(page * 1000 + i) for i in range(MOVIES_PER_PAGE)]}
+                elif credits:
+                    body = {"id": int(credits.group(1)), "cast": [{"name": f"Actor {n}"} for n in range(8)]}
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    @staticmethod
+    def movie(movie_id):
+        return {
+            "id": movie_id, "title": f"Stub Movie {movie_id}", "overview": "A stub overview with a twist.",
+            "poster_path": f"/{movie_id}.jpg", "release_date": "2020-01-01", "popularity": 100.0,
+            "vote_average": 7.0, "genre_ids": [28, 53], "adult": False,
+        }
+
+
+class BenchmarkPipeline(IngestPipeline):
+    """The sync's IngestPipeline with the DB write replaced by a no-op, so only fetching and classifying are timed."""
+
+    def _store(self, item):
+        page, rows = item
+        return page, list(rows)
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the TMDB sync pipeline (pages, credits, classify) against a local stub server (no network, no DB writes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=5, help='Popular pages to fetch (20 movies each)')
+        parser.add_argument('--latency-ms', type=float, default=50, help='Stub response latency')
+        parser.add_argument('--limit', type=int, default=40, help='Requests the stub allows per period')
+        parser.add_argument('--period', type=float, default=1.0,
+                            help='Rate-limit period in seconds (TMDB uses 10; shorter keeps the run quick)')
+        parser.add_argument('--workers', type=str, default='1,4,8', help='Comma-separated client thread counts')
+        parser.add_argument('--skip-baseline', action='store_true', help='Skip the old sequential fetch loop')
+
+    def handle(self, *args, **options):
+        pages = range(1, options['pages'] + 1)
+        with StubTMDB(options['latency_ms'] / 1000, options['limit'], options['period']) as stub:
+            self.stdout.write(f"{'client':<16}{'movies':>8}{'seconds':>10}{'movies/s':>10}{'max/window':>12}{'429s':>6}")
+            if not options['skip_baseline']:
+                self._report(stub, 'sequential', lambda: self._sequential(stub.url, pages))
+            for workers in [int(w) for w in options['workers'].split(',') if w.strip()]:
+                client = TMDBClient(api_key='stub', base_url=stub.url, max_workers=workers,
+                                    limiter=TokenBucket.for_budget(options['limit'], options['period']))
+                try:
+                    self._report(stub, f"pipeline x{workers}", lambda: self._pipeline(client, pages))
+                finally:
+                    client.close()
+
+    def _report(self, stub, label, run):
+        stub.reset()
+        start = time.perf_counter()
+        movies = run()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{label:<16}{movies:>8}{elapsed:>10.2f}{movies / elapsed:>10.1f}"
+                          f"{stub.max_in_window():>12}{stub.rejected:>6}")
+
+    @staticmethod
+    def _sequential(url, pages):
+        """The sync's previous loop: a fresh connection per request and a fixed 0.25 s sleep per movie."""
+        movies = 0
+        for page in pages:
+            results = requests.get(f"{url}/movie/popular?api_key=stub&page={page}", timeout=10).json()["results"]
+            for m in results:
+                requests.get(f"{url}/movie/{m['id']}/credits?api_key=stub", timeout=10).json()
+                time.sleep(0.25)
+                movies += 1
+        return movies
+
+    @staticmethod
+    def _pipeline(client, pages):
+        """What fetch_movies runs, minus the DB: pages, then credits fetched concurrently, then classify."""
+        pipeline = BenchmarkPipeline(client, Checkpoint(None), queue_size=getattr(settings, 'INGEST_QUEUE_SIZE', 4), delta=False)
+        return pipeline.run(pages)
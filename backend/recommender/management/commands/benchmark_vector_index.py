@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from recommender.vector_store import SimpleVectorDB
+
+
+class Command(BaseCommand):
+    help = 'Compares recall and latency of the IVF index and compressed storage against exact search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=20000, help='Synthetic catalogue size')
+        parser.add_argument('--dim', type=int, default=768, help='Embedding dimension')
+        parser.add_argument('--queries', type=int, default=200, help='Number of queries to time')
+        parser.add_argument('--k', type=int, default=100, help='Results per query (the search pool size)')
+        parser.add_argument('--nprobe', type=str, default='1,4,8,16,32', help='Comma-separated nprobe values to try')
+        parser.add_argument('--dtypes', type=str, default='float16,int8', help='Comma-separated compressed storage dtypes to try with exact search')
+        parser.add_argument('--use-store', action='store_true', help='Benchmark the real simple_chroma store instead of synthetic data')
+
+    def handle(self, *args, **options):
+        k = options['k']
+        tmp_dir = tempfile.mkdtemp(prefix='vector_bench_')
+        try:
+            if options['use_store']:
+                source = SimpleVectorDB(os.path.join(settings.BASE_DIR, "simple_chroma.json"))
+                if source.count() == 0:
+                    self.stdout.write(self.style.ERROR("The vector store is empty. Run backfill_chroma first."))
+                    return
+                data = source._exact_vectors(np.arange(source.count()))
+            else:
+                data = self._synthetic(options['size'], options['dim'])
+
+            path = os.path.join(tmp_dir, 'bench.json')
+            self.stdout.write(f"Building store with {len(data)} vectors of dim {data.shape[1]}...")
+            store = SimpleVectorDB(path)
+            with store.batch():
+                store.upsert(
+                    documents=[""] * len(data),
+                    embeddings=data,
+                    metadatas=[{}] * len(data),
+                    ids=[str(i) for i in range(len(data))],
+                )
+
+            # Queries: perturbed catalogue vectors, like a search for a known "vibe"
+            rng = np.random.default_rng(1)
+            picks = rng.choice(len(data), size=options['queries'])
+            queries = data[picks] + rng.normal(scale=0.05, size=(options['queries'], data.shape[1])).astype(np.float32)
+
+            exact = SimpleVectorDB(path)
+            exact_ids, exact_ms = self._run(exact, queries, k)
+            self.stdout.write(f"{'index':<16}{'recall@' + str(k):>12}{'ms/query':>12}{'speedup':>10}")
+            self.stdout.write(f"{'exact':<16}{1.0:>12.3f}{exact_ms:>12.2f}{1.0:>10.1f}")
+
+            for dtype in [d.strip() for d in options['dtypes'].split(',') if d.strip()]:
+                compressed = SimpleVectorDB(path, storage_dtype=dtype)
+                compressed.query(queries[:1], n_results=k)  # build the compressed matrix outside the timing
+                c_ids, c_ms = self._run(compressed, queries, k)
+                recall = np.mean([len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(exact_ids, c_ids)])
+                self.stdout.write(f"{'exact ' + dtype:<16}{recall:>12.3f}{c_ms:>12.2f}{exact_ms / c_ms:>10.1f}")
+
+            for nprobe in [int(p) for p in options['nprobe'].split(',') if p.strip()]:
+                ivf = SimpleVectorDB(path, index_type='ivf', ivf_nprobe=nprobe)
+                ivf.train_index()  # fit (or load) the centroids outside the timing
+                ivf.query(queries[:1], n_results=k)
+                ivf_ids, ivf_ms = self._run(ivf, queries, k)
+                recall = np.mean([len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(exact_ids, ivf_ids)])
+                self.stdout.write(f"{'ivf nprobe=' + str(nprobe):<16}{recall:>12.3f}{ivf_ms:>12.2f}{exact_ms / ivf_ms:>10.1f}")
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _synthetic(self, size, dim):
+        # Clustered data: real embeddings are far from uniform, and uniform
+        # noise is the worst case for any partitioning index.
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(max(1, size // 100), dim)).astype(np.float32)
+        data = centers[rng.integers(len(centers), size=size)]
+        data += rng.normal(scale=0.5, size=(size, dim)).astype(np.float32)
+        return data
+
+    def _run(self, store, queries, k):
+        ids = []
+        start = time.perf_counter()
+        for q in queries:
+            ids.append(store.query([q], n_results=k)["ids"][0])
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        return ids, elapsed_ms
@@ -0,0 +1,112 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from recommender.models import Movie, WatchHistory
+from recommender.prolog_pool import PrologEnginePool
+from recommender.reasoning import PrologReasoner, NumpyReasoner
+from recommender.services import normalized_path
+
+AGES = [0, 10, 13, 16, 18, 99]
+
+
+class Command(BaseCommand):
+    help = 'Differential check: runs the Prolog and NumPy reasoners on the same KB and compares every result'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, default=0, help='Use N synthetic movies instead of the database')
+        parser.add_argument('--pools', type=int, default=3, help='Random search pools per genre/mood/age combination')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        if options['synthetic']:
+            movies, likes, updates = self._synthetic(rng, options['synthetic'])
+        else:
+            movies = list(Movie.objects.order_by('updated_at').values_list(
+                'tmdb_id', 'title', 'genres', 'moods', 'min_age', 'release_year', 'popularity'))
+            likes = list(dict.fromkeys(WatchHistory.objects.filter(liked=True).order_by('pk').values_list('user_id', 'movie__tmdb_id')))
+            updates = []
+        if not movies:
+            raise CommandError("No movies to compare. Run fetch_movies or pass --synthetic N.")
+
+        # A private engine process, so the check never touches this process's KB
+        pool = PrologEnginePool(normalized_path, mode='process', size=1)
+        reasoners = [PrologReasoner(pool), NumpyReasoner()]
+        try:
+            for reasoner in reasoners:
+                reasoner.add_movies(movies)
+                reasoner.add_likes(likes)
+                # Edits move a movie to the end of the KB; both must agree on that too
+                for row in updates:
+                    reasoner.remove_movie(row[0])
+                    reasoner.add_movies([row])
+            self._compare(rng, reasoners, movies, likes, options['pools'])
+        finally:
+            pool.close()
+
+    def _compare(self, rng, reasoners, movies, likes, pools):
+        prolog_side, numpy_side = reasoners
+        genres = sorted({g.lower() for m in movies if isinstance(m[2], list) for g in m[2]})
+        moods = sorted({x.lower() for m in movies if isinstance(m[3], list) for x in m[3]})
+        ids = [m[0] for m in movies]
+
+        cases = []
+        for genre in ['any', 'no-such-genre'] + genres:
+            for mood in ['any', 'no-such-mood'] + moods:
+                for age in AGES:
+                    cases.append((f"recommend({genre}, {mood}, {age})", 'recommend', (genre, mood, age), {}))
+                    for _ in range(pools):
+                        pool_ids = rng.sample(ids, min(100, len(ids))) + [-1, ids[0]]  # unknown id and a duplicate
+                        cases.append((f"recommend({genre}, {mood}, {age}, pool)", 'recommend', (genre, mood, age), {'pool_ids': pool_ids}))
+        for tmdb_id in sorted({tmdb_id for _, tmdb_id in likes}):
+            cases.append((f"similar_to_movie({tmdb_id})", 'similar_to_movie', (tmdb_id,), {}))
+        for user_id in sorted({user_id for user_id, _ in likes}):
+            for age in AGES:
+                cases.append((f"similar_to_liked({user_id}, {age})", 'similar_to_liked', (user_id, age), {}))
+
+        set_mismatches = 0
+        order_mismatches = 0
+        results = 0
+        for label, method, args, kwargs in cases:
+            expected = getattr(prolog_side, method)(*args, **kwargs)
+            actual = getattr(numpy_side, method)(*args, **kwargs)
+            results += len(expected)
+            if expected == actual:
+                continue
+            if sorted(map(self._key, expected)) == sorted(map(self._key, actual)):
+                order_mismatches += 1
+                continue
+            set_mismatches += 1
+            if set_mismatches <= 5:
+                missing = set(map(self._key, expected)) - set(map(self._key, actual))
+                extra = set(map(self._key, actual)) - set(map(self._key, expected))
+                self.stdout.write(self.style.ERROR(f"{label}: {len(expected)} vs {len(actual)} results; "
+                                                   f"missing {sorted(missing)[:3]}, extra {sorted(extra)[:3]}"))
+
+        self.stdout.write(f"{len(cases)} queries, {results} Prolog results compared")
+        if order_mismatches:
+            self.stdout.write(self.style.WARNING(f"{order_mismatches} queries returned the same results in a different order"))
+        if set_mismatches:
+            raise CommandError(f"{set_mismatches} queries returned different results or explanations")
+        self.stdout.write(self.style.SUCCESS("Prolog and NumPy reasoners agree"))
+
+    @staticmethod
+    def _key(result):
+        return tuple(sorted((k, str(v)) for k, v in result.items()))
+
+    def _synthetic(self, rng, size):
+        genres = ['action', 'comedy', 'drama', 'horror', 'Romance', 'sci-fi', 'thriller']
+        moods = ['action-packed', 'funny', 'emotional', 'scary', 'romantic', 'mind-bending']
+        titles = ["Plain Title", "It's a Quote", "Back\\slash", "Café Unicode", "Line\nBreak"]
+        movies = []
+        for i in range(1, size + 1):
+            # Duplicate titles and repeated list entries are deliberate edge cases
+            title = f"{rng.choice(titles)} {i % (size // 2 or 1)}"
+            movie_genres = rng.sample(genres, rng.randint(0, 3))
+            if movie_genres and rng.random() < 0.05:
+                movie_genres.append(movie_genres[0])
+            movies.append((i, title, movie_genres, rng.sample(moods, rng.randint(0, 2)),
+                           rng.choice([0, 7, 13, 17, 18]), rng.randint(1970, 2025), rng.uniform(0, 500)))
+        likes = list(dict.fromkeys((rng.randint(1, 20), rng.randint(1, size)) for _ in range(size // 2)))
+        updates = [(m[0], m[1] + " (edited)", list(reversed(m[2])), m[3], m[4], m[5], m[6])
+                   for m in rng.sample(movies, max(1, size // 20))]
+        return movies, likes, updates
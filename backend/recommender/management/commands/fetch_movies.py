@@ -6,12 +6,14 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--pages', type=int, default=25, help='Number of pages to fetch (20 movies per page)')
+        parser.add_argument('--resume', action='store_true', help='Continue an interrupted crawl from its checkpoint')
+        parser.add_argument('--full', action='store_true', help='Re-fetch credits and rewrite every movie, even unchanged ones')
 
     def handle(self, *args, **options):
         pages = options['pages']
         self.stdout.write(f"Starting TMDB sync for {pages} pages (approx {pages*20} movies)...")
-        self.stdout.write("This may take a few minutes due to rate-limiting safety sleeps...")
+        self.stdout.write("Requests are paced to TMDB's rate limit (TMDB_RATE_LIMIT per TMDB_RATE_PERIOD seconds)...")
         
-        count = sync_movies_with_tmdb(max_pages=pages)
+        count = sync_movies_with_tmdb(max_pages=pages, resume=options['resume'], full=options['full'])
         
         self.stdout.write(self.style.SUCCESS(f"Successfully processed {count} movies!"))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recommender', '0003_movie_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recommender', '0004_movie_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='watchhistory',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -13,6 +13,8 @@ class Movie(models.Model):
     genres = models.JSONField(default=list)  
     moods = models.JSONField(default=list)   
     cast = models.JSONField(default=list)    
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # Prolog KB loads only rows changed since its last pass
+    fingerprint = models.CharField(max_length=64, blank=True, default='')  # hash of the TMDB fields the sync derives this row from
     
     def __str__(self):
         return self.title
@@ -30,3 +32,4 @@ class WatchHistory(models.Model):
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
     liked = models.BooleanField(default=True)
     watched_on = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # other workers' KBs pick up like/unlike toggles by this
@@ -0,0 +1,234 @@
+import atexit
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+class PrologError(Exception):
+    pass
+
+
+def _plain(value):
+    """pyswip terms -> plain, picklable Python values (atoms and strings become str)."""
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return str(getattr(value, 'value', value))
+
+
+def _run(engine, goal):
+    return [{k: _plain(v) for k, v in solution.items()} for solution in engine.query(goal)]
+
+
+def _new_engine(pl_path):
+    from pyswip import Prolog
+    engine = Prolog()
+    try:
+        engine.consult(pl_path)
+        print(f"Successfully loaded prologue file from {pl_path}")
+    except Exception as e:
+        print(f"Error loading prolog: {e}")
+    return engine
+
+
+@contextmanager
+def _facts_file(facts):
+    """Facts written to a temporary .pl file; yields the bulk_load_facts/1 goal that loads it."""
+    fd, path = tempfile.mkstemp(prefix='kb_facts_', suffix='.pl')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for fact in facts:
+                f.write(fact)
+                f.write(".\n")
+        yield f"bulk_load_facts('{path.replace(chr(92), '/')}')"
+    finally:
+        os.unlink(path)
+
+
+def _worker_main(conn, pl_path):
+    # Runs in a child process: one SWI engine with its own copy of the KB.
+    engine = _new_engine(pl_path)
+    while True:
+        try:
+            goal = conn.recv()
+        except EOFError:
+            return
+        if goal is None:
+            return
+        try:
+            conn.send(('ok', _run(engine, goal)))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def call(self, goal):
+        with self.lock:
+            self.conn.send(goal)
+            status, payload = self.conn.recv()
+        if status != 'ok':
+            raise PrologError(payload)
+        return payload
+
+
+# What conn.send()/recv() raise once the worker process is gone
+_WORKER_DIED = (EOFError, OSError)
+
+
+class PrologEnginePool:
+    """
+    Thread-safe access to the recommendation KB.
+
+    ``mode='inline'`` keeps a single SWI engine in this process behind a
+    lock; pyswip allows only one open query per process, so request threads
+    must not interleave on it. ``mode='process'`` runs ``size`` worker
+    processes, each with its own engine and full copy of the KB, so queries
+    from concurrent request threads run in parallel.
+
+    query() is for read-only goals and runs on whichever engine is free.
+    Anything that changes the KB must go through write() (or assertz() /
+    retractall()), which applies it to every engine in the same order.
+    Results are lists of dicts of plain Python values in both modes.
+    Engines start on first use.
+
+    In process mode a worker that dies is replaced by a new process, which
+    is loaded with ``kb_facts()`` (a callable returning the facts, as Prolog
+    source, that make up the KB now), and the query that found it dead is
+    retried once on the replacement.
+    """
+
+    def __init__(self, pl_path, mode='inline', size=None, kb_facts=None):
+        if mode not in ('inline', 'process'):
+            raise ValueError(f"Unknown Prolog pool mode {mode!r}")
+        self.pl_path = pl_path
+        self.mode = mode
+        self.size = 1 if mode == 'inline' else (size or os.cpu_count() or 1)
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._engine = None
+        self._engine_lock = threading.RLock()
+        self._workers = []
+        self._idle = queue.Queue()
+        self.kb_facts = kb_facts
+
+    def _start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            if self.mode == 'inline':
+                self._engine = _new_engine(self.pl_path)
+            else:
+                for i in range(self.size):
+                    self._workers.append(self._spawn(i))
+                    self._idle.put(i)
+                atexit.register(self.close)
+                print(f"Started {self.size} Prolog worker processes")
+            self._started = True
+
+    def _spawn(self, i):
+        # spawn, not fork: the parent may already hold an engine or
+        # Django's DB connections, neither of which survives a fork.
+        ctx = multiprocessing.get_context('spawn')
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(target=_worker_main, args=(child_conn, self.pl_path),
+                              name=f"prolog-worker-{i}", daemon=True)
+        process.start()
+        child_conn.close()
+        return _Worker(process, parent_conn)
+
+    def _replace(self, i, dead, error):
+        """Swap the dead worker i for a new one loaded with kb_facts(). Caller holds _write_lock."""
+        if self._workers[i] is not dead:
+            return  # another thread got here first
+        print(f"Prolog worker {i} died ({type(error).__name__}: {error}); starting a new one")
+        dead.conn.close()
+        dead.process.join(timeout=1)
+        if dead.process.is_alive():
+            dead.process.terminate()
+        worker = self._spawn(i)
+        if self.kb_facts is None:
+            print(f"No kb_facts for Prolog worker {i}: it starts with {self.pl_path} only")
+        else:
+            try:
+                with _facts_file(self.kb_facts()) as goal:
+                    worker.call(goal)
+            except PrologError as e:
+                print(f"Failed to reload the KB into Prolog worker {i}: {e}")
+        self._workers[i] = worker
+
+    def query(self, goal):
+        """All solutions of a read-only goal."""
+        self._start()
+        if self.mode == 'inline':
+            with self._engine_lock:
+                return _run(self._engine, goal)
+        i = self._idle.get()
+        try:
+            worker = self._workers[i]
+            try:
+                return worker.call(goal)
+            except _WORKER_DIED as e:
+                with self._write_lock:
+                    self._replace(i, worker, e)
+            return self._workers[i].call(goal)
+        finally:
+            self._idle.put(i)
+
+    def write(self, goal):
+        """Run a goal that changes the KB on every engine."""
+        self._start()
+        if self.mode == 'inline':
+            with self._engine_lock:
+                return _run(self._engine, goal)
+        with self._write_lock:
+            return self._write_all(goal)
+
+    def load_facts(self, facts):
+        """Add facts (Prolog source, no trailing period) to every engine with one bulk_load_facts/1 call each."""
+        self._start()
+        with _facts_file(facts) as goal:
+            if self.mode == 'inline':
+                with self._engine_lock:
+                    _run(self._engine, goal)
+                return
+            with self._write_lock:
+                self._write_all(goal)
+
+    def _write_all(self, goal):
+        # Caller holds _write_lock
+        results = None
+        for i in range(len(self._workers)):
+            worker = self._workers[i]
+            try:
+                results = worker.call(goal)
+            except _WORKER_DIED as e:
+                self._replace(i, worker, e)
+                results = self._workers[i].call(goal)
+        return results
+
+    def assertz(self, fact):
+        self.write(f"assertz(({fact}))")
+
+    def retractall(self, head):
+        self.write(f"retractall({head})")
+
+    def close(self):
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+                worker.process.join(timeout=5)
+            except Exception:
+                worker.process.terminate()
+        self._workers = []
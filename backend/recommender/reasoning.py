@@ -0,0 +1,417 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from . import bitsets
+
+
+def clean_atom(s):
+    """Text as it ends up inside a Prolog atom: one line, printable ASCII only."""
+    if not isinstance(s, str):
+        s = str(s)
+    s = s.replace('\\', ' ')
+    s = s.replace('\n', ' ').replace('\r', ' ')
+    # Remove characters that might break PySWIP FFI
+    s = "".join(c for c in s if ord(c) < 128 and c.isprintable())
+    return s.strip()
+
+def safe_prolog_atom(s):
+    # Standard prolog single-quote escaping is two single quotes
+    return clean_atom(s).replace("'", "''")
+
+def movie_fact(tmdb_id, title, genres, moods, min_age, release_year, popularity):
+    """The movie/7 fact for one movie, as Prolog source."""
+    # safely parse lists
+    g_list = genres if isinstance(genres, list) else []
+    m_list = moods if isinstance(moods, list) else []
+
+    genres_str = "[" + ",".join([f"'{safe_prolog_atom(g).lower()}'" for g in g_list]) + "]"
+    moods_str = "[" + ",".join([f"'{safe_prolog_atom(mood).lower()}'" for mood in m_list]) + "]"
+    return f"movie({tmdb_id}, '{safe_prolog_atom(title)}', {genres_str}, {moods_str}, {min_age}, {release_year}, {int(popularity)})"
+
+BULK_LOAD_MIN_FACTS = 200  # below this, individual asserts beat writing a temp file
+
+def assert_facts(engine, facts, bulk=None):
+    """
+    Assert Prolog facts (source strings, no trailing period) on ``engine``.
+    Large sets go through the pool's load_facts(), a single bulk_load_facts/1
+    call; user_likes/2 facts already in the KB are skipped.
+
+    Returns the facts whose assert raised. The bulk loader skips unreadable
+    terms without raising, so callers that must know check the KB afterwards.
+    """
+    if bulk is None:
+        bulk = len(facts) >= BULK_LOAD_MIN_FACTS
+    if not bulk:
+        failed = []
+        for fact in facts:
+            try:
+                engine.write(f"assert_fact({fact})")
+            except Exception as e:
+                print(f"Failed to assert {fact[:80]} - error: {e}")
+                failed.append(fact)
+        return failed
+
+    engine.load_facts(facts)
+    return []
+
+
+def relaxation_tiers(pref_genre, pref_mood):
+    """(tier, genre, mood) in the order relaxation/5 in recommendation.pl tries them."""
+    tiers = [(0, pref_genre, pref_mood)]
+    if pref_mood != 'any':
+        tiers.append((1, pref_genre, 'any'))
+    if pref_genre != 'any':
+        tiers.append((2, 'any', pref_mood))
+    if not (pref_genre == 'any' and pref_mood == 'any'):
+        tiers.append((3, 'any', 'any'))
+    return tiers
+
+def construct_explanation(pref_genre, pref_mood, min_age):
+    """construct_explanation/7 from recommendation.pl."""
+    if pref_genre == 'any' and pref_mood == 'any':
+        return f"Recommended as a great general watch suitable for your age (rated for {min_age}+)."
+    if pref_mood == 'any':
+        return f"Recommended because it strongly matches your preferred genre ({pref_genre}) and is appropriate for your age group."
+    if pref_genre == 'any':
+        return f"Recommended because it delivers the {pref_mood} vibe you are looking for, while being suitable for your age."
+    return f"This movie is a perfect fit. It is a {pref_genre} movie that matches your {pref_mood} mood, and is rated for viewers {min_age} and up."
+
+
+class PrologReasoner:
+    """The rules in recommendation.pl, evaluated by SWI-Prolog through a PrologEnginePool."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def add_movies(self, rows):
+        """
+        rows: (tmdb_id, title, genres, moods, min_age, release_year, popularity)
+        tuples. Returns the tmdb_ids that did not make it into the KB.
+        """
+        if not rows:
+            return []
+        assert_facts(self.engine, [movie_fact(*row) for row in rows])
+        ids = ",".join(str(row[0]) for row in rows)
+        return self.engine.query(
+            f"findall(ID, (member(ID, [{ids}]), \\+ movie(ID, _, _, _, _, _, _)), Missing)")[0]["Missing"]
+
+    def remove_movie(self, tmdb_id):
+        self.engine.write(f"remove_movie({tmdb_id})")
+
+    def remove_movies(self, tmdb_ids):
+        """remove_movie for many movies in one write."""
+        if tmdb_ids:
+            self.engine.write(f"forall(member(ID, [{','.join(map(str, tmdb_ids))}]), remove_movie(ID))")
+
+    def add_likes(self, pairs):
+        """Returns the (user_id, tmdb_id) pairs that did not make it into the KB."""
+        if not pairs:
+            return []
+        assert_facts(self.engine, [f"user_likes({user_id}, {tmdb_id})" for user_id, tmdb_id in pairs])
+        pairs_str = ",".join(f"[{user_id},{tmdb_id}]" for user_id, tmdb_id in pairs)
+        missing = self.engine.query(
+            f"findall([U, M], (member([U, M], [{pairs_str}]), \\+ user_likes(U, M)), Missing)")[0]["Missing"]
+        return [tuple(pair) for pair in missing]
+
+    def remove_like(self, user_id, tmdb_id):
+        self.engine.retractall(f"user_likes({user_id}, {tmdb_id})")
+
+    def recommend(self, pref_genre, pref_mood, user_age, pool_ids=None):
+        if pool_ids is None:
+            query = f"recommend_movie_relaxed('{pref_genre}', '{pref_mood}', {user_age}, Tier, ID, Title, Explanation, Popularity)"
+        else:
+            pool_str = "[" + ",".join(map(str, pool_ids)) + "]"
+            query = f"recommend_movie_in_pool_relaxed('{pref_genre}', '{pref_mood}', {user_age}, {pool_str}, Tier, ID, Title, Explanation, Popularity)"
+        return self.engine.query(query)
+
+    def similar_to_liked(self, user_id, user_age):
+        return self.engine.query(f"recommend_similar_to_liked({user_id}, {user_age}, ID, Title, Explanation, Popularity)")
+
+    def liked_movies(self, user_id):
+        return [row["MovieID"] for row in self.engine.query(f"user_likes({user_id}, MovieID)")]
+
+    def similar_to_movie(self, tmdb_id):
+        return self.engine.query(f"similar_to_movie({tmdb_id}, ID, Title, MinAge, Popularity, Explanation)")
+
+
+class _Snapshot:
+    """Immutable columnar view of the catalogue that queries run against."""
+
+    def __init__(self, ids, titles, genres, moods, genre_masks, mood_masks, min_age, popularity, alive):
+        self.ids = np.array(ids, dtype=np.int64)
+        self.titles = np.array(titles, dtype=object)
+        self.genres = genres
+        self.moods = moods
+        self.min_age = np.array(min_age, dtype=np.float64)
+        self.min_age_values = min_age  # as written into the Prolog fact, for explanations
+        self.popularity = np.array(popularity, dtype=np.int64)
+        self.alive = np.array(alive, dtype=bool)
+        self.genre_bits = bitsets.pack(genre_masks, bitsets.GENRE_VOCAB.words)
+        self.mood_bits = bitsets.pack(mood_masks, bitsets.MOOD_VOCAB.words)
+
+    def has_genre(self, genre):
+        return bitsets.has_bit(self.genre_bits, bitsets.GENRE_VOCAB.bit(genre))
+
+    def has_mood(self, mood):
+        return bitsets.has_bit(self.mood_bits, bitsets.MOOD_VOCAB.bit(mood))
+
+    def match(self, pref_genre, pref_mood, user_age):
+        """check_rating + match_pref over every row."""
+        mask = self.alive & (self.min_age <= user_age)
+        if pref_genre != 'any':
+            mask &= self.has_genre(pref_genre)
+        if pref_mood != 'any':
+            mask &= self.has_mood(pref_mood)
+        return mask
+
+
+class NumpyReasoner:
+    """
+    The same rules as recommendation.pl over NumPy columns: genres and moods
+    as bitsets (see bitsets.py), min_age and popularity as vectors. Results, explanations and
+    their order match the Prolog backend (see the compare_reasoners
+    command); there is no FFI round trip per query.
+
+    Writes append to row lists; the columns are rebuilt on the next query.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ids = []
+        self._titles = []
+        self._genres = []
+        self._moods = []
+        self._genre_masks = []
+        self._mood_masks = []
+        self._min_age = []
+        self._popularity = []
+        self._alive = []
+        self._row = {}  # tmdb_id -> live row
+        self._likes = {}  # user_id -> {tmdb_id: None}, in like order
+        self._snapshot = None
+
+    def add_movies(self, rows):
+        with self._lock:
+            for tmdb_id, title, genres, moods, min_age, release_year, popularity in rows:
+                if tmdb_id in self._row:
+                    self.remove_movie(tmdb_id)
+                self._row[tmdb_id] = len(self._ids)
+                self._ids.append(tmdb_id)
+                self._titles.append(clean_atom(title))
+                genre_list = [clean_atom(g).lower() for g in genres] if isinstance(genres, list) else []
+                mood_list = [clean_atom(m).lower() for m in moods] if isinstance(moods, list) else []
+                self._genres.append(genre_list)
+                self._moods.append(mood_list)
+                self._genre_masks.append(bitsets.GENRE_VOCAB.mask(genre_list))
+                self._mood_masks.append(bitsets.MOOD_VOCAB.mask(mood_list))
+                self._min_age.append(min_age)
+                self._popularity.append(int(popularity))
+                self._alive.append(True)
+            self._snapshot = None
+        return []
+
+    def remove_movie(self, tmdb_id):
+        with self._lock:
+            row = self._row.pop(tmdb_id, None)
+            if row is not None:
+                self._alive[row] = False
+                self._snapshot = None
+            if len(self._ids) > 1024 and len(self._row) < len(self._ids) // 2:
+                self._compact()
+
+    def remove_movies(self, tmdb_ids):
+        with self._lock:
+            for tmdb_id in tmdb_ids:
+                self.remove_movie(tmdb_id)
+
+    def _compact(self):
+        live = [i for i, alive in enumerate(self._alive) if alive]
+        for name in ('_ids', '_titles', '_genres', '_moods', '_genre_masks', '_mood_masks', '_min_age', '_popularity'):
+            values = getattr(self, name)
+            setattr(self, name, [values[i] for i in live])
+        self._alive = [True] * len(live)
+        self._row = {tmdb_id: i for i, tmdb_id in enumerate(self._ids)}
+
+    def add_likes(self, pairs):
+        with self._lock:
+            for user_id, tmdb_id in pairs:
+                self._likes.setdefault(user_id, {}).setdefault(tmdb_id, None)
+        return []
+
+    def remove_like(self, user_id, tmdb_id):
+        with self._lock:
+            self._likes.get(user_id, {}).pop(tmdb_id, None)
+
+    def _columns(self):
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = _Snapshot(list(self._ids), list(self._titles), list(self._genres), list(self._moods),
+                                           self._genre_masks, self._mood_masks,
+                                           list(self._min_age), list(self._popularity), list(self._alive))
+            return self._snapshot, dict(self._row)
+
+    def _result(self, snap, row, explanation, tier=None):
+        result = {"ID": int(snap.ids[row]), "Title": snap.titles[row],
+                  "Explanation": explanation, "Popularity": int(snap.popularity[row])}
+        if tier is not None:
+            result["Tier"] = tier
+        return result
+
+    def recommend(self, pref_genre, pref_mood, user_age, pool_ids=None):
+        snap, row_of = self._columns()
+        for tier, genre, mood in relaxation_tiers(pref_genre, pref_mood):
+            mask = snap.match(genre, mood, user_age)
+            if pool_ids is None:
+                rows = np.flatnonzero(mask)
+            else:
+                # Pool order, like member(ID, PoolIDs) driving the Prolog rule
+                rows = [row_of[i] for i in pool_ids if i in row_of and mask[row_of[i]]]
+            if len(rows):
+                return [self._result(snap, row, construct_explanation(genre, mood, snap.min_age_values[row]), tier)
+                        for row in rows]
+        return []
+
+    def liked_movies(self, user_id):
+        with self._lock:
+            return list(self._likes.get(user_id, {}))
+
+    def _similar_rows(self, snap, liked_row, eligible):
+        """(row, genre, mood) solutions of similar_to_movie/6, in Prolog's order."""
+        liked_title = snap.titles[liked_row]
+        liked_moods = snap.moods[liked_row]
+        # Only movies sharing at least one genre and one mood qualify:
+        # popcount of the ANDed bitsets, one pass over the catalogue.
+        candidates = (eligible & (snap.titles != liked_title)
+                      & (bitsets.overlap(snap.genre_bits, snap.genre_bits[liked_row]) > 0)
+                      & (bitsets.overlap(snap.mood_bits, snap.mood_bits[liked_row]) > 0))
+        if not candidates.any():
+            return
+        mood_masks = [snap.has_mood(m) for m in liked_moods]
+        for genre in snap.genres[liked_row]:
+            # Same nesting as the Prolog rule: genre, candidate, mood
+            for row in np.flatnonzero(candidates & snap.has_genre(genre)):
+                for mood, mood_mask in zip(liked_moods, mood_masks):
+                    if mood_mask[row]:
+                        yield row, genre, mood
+
+    @staticmethod
+    def _liked_explanation(liked_title, genre, mood):
+        return f"Recommended because you liked {liked_title}, which shares the {genre} genre and {mood} vibe."
+
+    def similar_to_movie(self, tmdb_id):
+        snap, row_of = self._columns()
+        liked_row = row_of.get(tmdb_id)
+        if liked_row is None:
+            return []
+        results = []
+        for row, genre, mood in self._similar_rows(snap, liked_row, snap.alive):
+            result = self._result(snap, row, self._liked_explanation(snap.titles[liked_row], genre, mood))
+            result["MinAge"] = snap.min_age_values[row]
+            results.append(result)
+        return results
+
+    def similar_to_liked(self, user_id, user_age):
+        snap, row_of = self._columns()
+        eligible = snap.alive & (snap.min_age <= user_age)
+        results = []
+        for liked_id in self.liked_movies(user_id):
+            liked_row = row_of.get(liked_id)
+            if liked_row is None:
+                continue
+            for row, genre, mood in self._similar_rows(snap, liked_row, eligible):
+                results.append(self._result(snap, row, self._liked_explanation(snap.titles[liked_row], genre, mood)))
+        return results
+
+
+class _UserCandidates:
+    """One user's materialised similar-to-liked set."""
+
+    def __init__(self):
+        self.liked = {}  # liked tmdb_id -> candidate ids it contributed
+        self.sources = {}  # candidate tmdb_id -> {liked tmdb_id: explanation}, in like order
+        self.min_age = {}
+
+    def __len__(self):
+        return len(self.sources)
+
+    def add(self, liked_id, solutions):
+        if liked_id in self.liked:
+            return
+        contributed = []
+        for solution in solutions:
+            candidate = solution["ID"]
+            explanations = self.sources.setdefault(candidate, {})
+            if liked_id not in explanations:  # the first solution is the best one
+                explanations[liked_id] = solution["Explanation"]
+                contributed.append(candidate)
+            self.min_age[candidate] = solution["MinAge"]
+        self.liked[liked_id] = contributed
+
+    def remove(self, liked_id):
+        for candidate in self.liked.pop(liked_id, []):
+            explanations = self.sources[candidate]
+            explanations.pop(liked_id, None)
+            if not explanations:
+                del self.sources[candidate]
+                del self.min_age[candidate]
+
+    def explanation(self, tmdb_id, user_age):
+        """Why tmdb_id is similar to something the user liked, or None."""
+        explanations = self.sources.get(tmdb_id)
+        if not explanations or self.min_age[tmdb_id] > user_age:
+            return None
+        return next(iter(explanations.values()))
+
+
+class SimilarToLikedCache:
+    """
+    recommend_similar_to_liked materialised per user: candidate tmdb_id ->
+    explanation (plus its min_age, so the age check stays a lookup). A user's
+    set is built on first use from similar_to_movie for each liked movie and
+    then patched as likes come and go, instead of re-running the join on
+    every request. At most ``max_users`` users are kept (LRU). Call clear()
+    when movies are added or changed.
+    """
+
+    def __init__(self, reasoner, max_users=1000):
+        self.reasoner = reasoner
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                self._users.move_to_end(user_id)
+                return entry
+        entry = _UserCandidates()
+        for liked_id in self.reasoner.liked_movies(user_id):
+            entry.add(liked_id, self.reasoner.similar_to_movie(liked_id))
+        with self._lock:
+            entry = self._users.setdefault(user_id, entry)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return entry
+
+    def like_added(self, user_id, tmdb_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+        if entry is None:
+            return  # built from the reasoner's likes when next needed
+        solutions = self.reasoner.similar_to_movie(tmdb_id)
+        with self._lock:
+            entry.add(tmdb_id, solutions)
+
+    def like_removed(self, user_id, tmdb_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                entry.remove(tmdb_id)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
@@ -1,207 +1,412 @@
+import hashlib
+import json
 import os
-from pyswip import Prolog
+import threading
+import uuid
 from django.conf import settings
-
-prolog = Prolog()
+from django.core.cache import cache
+from .vector_store import SimpleVectorDB
+from .embeddings import get_openrouter_embedding, embed_text, get_embedding_cache
+from .prolog_pool import PrologEnginePool
+from .reasoning import PrologReasoner, NumpyReasoner, SimilarToLikedCache, relaxation_tiers, movie_fact
+from .catalogue import MovieCatalogue, RECORD_FIELDS
 
 # Resolve path for Prolog file
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 prolog_file_path = os.path.join(base_dir, 'ai_engine', 'recommendation.pl')
 normalized_path = prolog_file_path.replace("\\", "/")
 
-try:
-    prolog.consult(normalized_path)
-    print(f"Successfully loaded prologue file from {normalized_path}")
-except Exception as e:
-    print(f"Error loading prolog: {e}")
+# Shared by every request thread. Reads use prolog.query(); anything that
+# changes the KB must use prolog.write() / assertz() / retractall().
+prolog = PrologEnginePool(
+    normalized_path,
+    mode=getattr(settings, 'PROLOG_POOL_MODE', 'inline'),
+    size=getattr(settings, 'PROLOG_POOL_SIZE', None),
+    kb_facts=lambda: current_kb_facts(),
+)
 
-def get_openrouter_embedding(text):
-    import requests
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    model_name = os.getenv("OPENROUTER_EMBEDDING_MODEL", "nomic-ai/nomic-embed-text-v1.5")
-    
-    if not api_key:
-        print("OPENROUTER_API_KEY not found in environment variables.")
-        return None
-        
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "model": model_name,
-        "input": text
-    }
-    
-    try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/embeddings",
-            headers=headers,
-            json=payload,
-            timeout=10
-        )
-        if not response.ok:
-            print(f"OpenRouter API Error: {response.status_code} - {response.text}")
-        response.raise_for_status()
-        data = response.json()
-        if data and "data" in data and len(data["data"]) > 0:
-            return data["data"][0]["embedding"]
-        return None
-    except Exception as e:
-        print(f"Exception calling OpenRouter embeddings API: {e}")
-        return None
+_reasoner = None
+_reasoner_lock = threading.Lock()
 
-class SimpleVectorDB:
-    def __init__(self, path):
-        import json, os
-        self.path = path
-        self.data = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
-        if os.path.exists(path):
-            try:
-                with open(path, 'r', encoding='utf-8') as f:
-                    self.data = json.load(f)
-            except: pass
-
-    def save(self):
-        import json
-        with open(self.path, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f)
-
-    def upsert(self, documents, embeddings, metadatas, ids):
-        for doc, emb, meta, _id in zip(documents, embeddings, metadatas, ids):
-            if _id in self.data["ids"]:
-                idx = self.data["ids"].index(_id)
-                self.data["embeddings"][idx] = emb
-                self.data["documents"][idx] = doc
-                self.data["metadatas"][idx] = meta
+def get_reasoner():
+    """The rule engine selected by settings.RECOMMENDER_REASONING_BACKEND ('prolog' or 'numpy')."""
+    global _reasoner
+    with _reasoner_lock:
+        if _reasoner is None:
+            backend = getattr(settings, 'RECOMMENDER_REASONING_BACKEND', 'prolog')
+            if backend == 'numpy':
+                _reasoner = NumpyReasoner()
+            elif backend == 'prolog':
+                _reasoner = PrologReasoner(prolog)
             else:
-                self.data["ids"].append(_id)
-                self.data["embeddings"].append(emb)
-                self.data["documents"].append(doc)
-                self.data["metadatas"].append(meta)
-        self.save()
-
-    def query(self, query_embeddings, n_results=10):
-        import numpy as np
-        if not self.data["embeddings"]: return {"ids": [[]], "distances": [[]]}
-        
-        q_emb = np.array(query_embeddings[0])
-        db_embs = np.array(self.data["embeddings"])
-        
-        # Cosine similarity calculation
-        q_norm = np.linalg.norm(q_emb)
-        db_norms = np.linalg.norm(db_embs, axis=1)
-        
-        # Avoid division by zero
-        norms = q_norm * db_norms
-        norms[norms == 0] = 1e-10
-        
-        similarities = np.dot(db_embs, q_emb) / norms
-        
-        top_indices = np.argsort(similarities)[::-1][:n_results]
-        
-        return {
-            "ids": [[self.data["ids"][i] for i in top_indices]],
-            "distances": [[1.0 - similarities[i] for i in top_indices]]
-        }
+                raise ValueError(f"Unknown RECOMMENDER_REASONING_BACKEND {backend!r}")
+        return _reasoner
+
+_similar_to_liked = None
+
+def get_similar_to_liked_cache():
+    global _similar_to_liked
+    reasoner = get_reasoner()
+    with _reasoner_lock:
+        if _similar_to_liked is None:
+            _similar_to_liked = SimilarToLikedCache(reasoner, max_users=getattr(settings, 'SIMILAR_TO_LIKED_CACHE_USERS', 1000))
+        return _similar_to_liked
+
+def set_user_like(user_id, tmdb_id, liked):
+    """Apply a swipe to the reasoner and to the user's similar-to-liked set."""
+    if liked:
+        get_reasoner().add_likes([(user_id, tmdb_id)])
+        get_similar_to_liked_cache().like_added(user_id, tmdb_id)
+    else:
+        get_reasoner().remove_like(user_id, tmdb_id)
+        get_similar_to_liked_cache().like_removed(user_id, tmdb_id)
+    bump_likes_generation(user_id)
+
+# ── Recommendation result cache (Django cache framework) ──
+# Keys include the KB high-water mark and a per-user likes token, so new or
+# edited movies and a user's swipes make old entries unreachable; they then
+# age out by TTL / LRU.
+
+def _likes_generation_key(user_id):
+    return f"recs:likes:{user_id}"
+
+def likes_generation(user_id):
+    """Opaque token that changes whenever the user's likes do."""
+    if not user_id:
+        return ""
+    key = _likes_generation_key(user_id)
+    token = cache.get(key)
+    if token is None:
+        # Never reuse an old token after eviction: start a fresh one
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        token = cache.get(key)
+    return token
+
+def bump_likes_generation(user_id):
+    cache.set(_likes_generation_key(user_id), uuid.uuid4().hex, timeout=None)
+
+def ranking_params(pref_genre, pref_mood, user_age, search_query, user_id):
+    """The request parameters a ranking depends on, normalised."""
+    pref_genre = pref_genre.strip().lower() if pref_genre else 'any'
+    pref_mood = pref_mood.strip().lower() if pref_mood else 'any'
+    query = " ".join(search_query.lower().split()) if search_query else ""
+    return [pref_genre, pref_mood, int(user_age), query, str(user_id or "")]
+
+def recommendation_cache_key(pref_genre, pref_mood, user_age, search_query, user_id):
+    raw = json.dumps(ranking_params(pref_genre, pref_mood, user_age, search_query, user_id) + [
+        str(_movies_high_water), _movies_loaded_late, likes_generation(user_id),
+    ])
+    return "recs:" + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+_vector_index = None
+_vector_index_lock = threading.Lock()
 
 def get_chroma_collection():
-    try:
-        db_path = os.path.join(settings.BASE_DIR, "simple_chroma.json")
-        return SimpleVectorDB(db_path)
-    except Exception as e:
-        print(f"Exception initializing SimpleVectorDB: {e}")
-        return None
+    """
+    Return the process-wide vector index. It is read from disk once and then
+    only reloaded when another process (usually a Celery sync) rewrites it.
+    """
+    global _vector_index
+    with _vector_index_lock:
+        try:
+            if _vector_index is None:
+                db_path = os.path.join(settings.BASE_DIR, "simple_chroma.json")
+                _vector_index = SimpleVectorDB(
+                    db_path,
+                    index_type=getattr(settings, 'VECTOR_INDEX_TYPE', 'exact'),
+                    ivf_nlist=getattr(settings, 'VECTOR_IVF_NLIST', None),
+                    ivf_nprobe=getattr(settings, 'VECTOR_IVF_NPROBE', 8),
+                    storage_dtype=getattr(settings, 'VECTOR_STORAGE_DTYPE', 'float32'),
+                    rerank=getattr(settings, 'VECTOR_RERANK', 200),
+                )
+            else:
+                _vector_index.refresh()
+            return _vector_index
+        except Exception as e:
+            print(f"Exception initializing SimpleVectorDB: {e}")
+            return None
+
+def build_vector_filter(pref_genre, pref_mood, user_age):
+    """Vector-store `where` filter equivalent to check_rating/match_pref in recommendation.pl."""
+    clauses = [{"min_age": {"$lte": user_age}}]
+    if pref_genre != 'any':
+        clauses.append({"genres": {"$contains": pref_genre}})
+    if pref_mood != 'any':
+        clauses.append({"moods": {"$contains": pref_mood}})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+def vector_metadata(movie_id, title, min_age, genres, moods):
+    """Metadata stored with each movie vector; the filter fields must match build_vector_filter."""
+    return {
+        "tmdb_id": movie_id,
+        "title": title,
+        "min_age": min_age,
+        "genres": [g.lower() for g in genres],
+        "moods": [m.lower() for m in moods],
+    }
 
-_loaded_tmdb_ids = set()  # Track which movies are already in Prolog
+_loaded_tmdb_ids = {}  # tmdb_id -> updated_at of the version loaded into the reasoner
+catalogue = MovieCatalogue()  # card fields for every loaded movie, used to hydrate results
+_movies_high_water = None  # newest Movie.updated_at loaded so far
+_movies_loaded_late = 0  # movies loaded with an updated_at behind the high-water mark (part of the cache key)
+_applied_likes = {}  # (user_id, tmdb_id) -> updated_at of the like/unlike applied to the reasoner
+_retry_tmdb_ids = set()  # movies whose facts failed to load; re-read on every pass until they do
+_retry_likes = set()  # (user_id, tmdb_id) likes that failed to load, retried the same way
+_likes_high_water = None  # newest WatchHistory.updated_at applied so far
+_kb_lock = threading.Lock()
+
+def _since(high_water):
+    """Lower bound for an incremental scan: the high-water mark minus the overlap window."""
+    from datetime import timedelta
+    return high_water - timedelta(seconds=getattr(settings, 'KB_RELOAD_OVERLAP_SECONDS', 60))
+
+def current_kb_facts():
+    """
+    movie/7 and user_likes/2 facts for what load_prolog_kb has applied so far,
+    rebuilt from the database, for a Prolog worker that replaces a dead one.
+    A movie whose row has moved past the loaded version is left out; the
+    next load_prolog_kb adds it like any other edit.
+    """
+    from .models import Movie, WatchHistory
+    loaded = dict(_loaded_tmdb_ids)
+    rows = Movie.objects.filter(tmdb_id__in=list(loaded)).values_list(
+        'tmdb_id', 'title', 'genres', 'moods', 'min_age', 'release_year', 'popularity', 'updated_at')
+    facts = [movie_fact(*row[:7]) for row in rows.iterator(chunk_size=2000) if loaded[row[0]] == row[7]]
+    likes = WatchHistory.objects.filter(liked=True).order_by('pk').values_list('user_id', 'movie__tmdb_id')
+    facts.extend(f"user_likes({user_id}, {tmdb_id})" for user_id, tmdb_id in likes.iterator(chunk_size=5000))
+    return facts
 
 def load_prolog_kb():
-    global _loaded_tmdb_ids
+    """
+    Bring the reasoner's KB up to date with the database. Only rows changed
+    since the previous call are read (one indexed query per table), so
+    calling this on every request is cheap once the KB is warm. The scan
+    reaches KB_RELOAD_OVERLAP_SECONDS behind the high-water mark, because
+    updated_at is stamped before the row commits; rows already applied at
+    that version are skipped. A movie edited by a TMDB re-sync has its old
+    fact retracted before the new one is asserted. Facts the reasoner fails
+    to load are not recorded as loaded and are retried on later passes. On a
+    cold worker everything arrives through one bulk load. The same pass
+    refreshes the in-memory movie catalogue.
+    """
+    global _movies_high_water, _movies_loaded_late, _likes_high_water
     from .models import Movie, WatchHistory
-    
-    # 1. Load NEW movies that aren't in Prolog yet
+    reasoner = get_reasoner()
+
+    with _kb_lock:
+        # 1. Load new and changed movies
+        try:
+            movies = Movie.objects.all()
+            if _movies_high_water is not None:
+                from django.db.models import Q
+                movies = movies.filter(Q(updated_at__gte=_since(_movies_high_water)) | Q(tmdb_id__in=list(_retry_tmdb_ids)))
+            rows = movies.order_by('updated_at').values_list(
+                'tmdb_id', 'title', 'genres', 'moods', 'min_age', 'release_year', 'popularity', 'updated_at',
+                'overview', 'poster_url', 'rating', 'cast')
+
+            new_rows = []
+            records = []
+            versions = {}
+            stale = []
+            late = set()
+            high_water = _movies_high_water
+            for (tmdb_id, title, genres, moods, min_age, release_year, popularity, updated_at,
+                 overview, poster_url, rating, cast) in rows.iterator(chunk_size=2000):
+                high_water = updated_at if high_water is None else max(high_water, updated_at)
+                if _loaded_tmdb_ids.get(tmdb_id) == updated_at:
+                    continue  # This version is already loaded
+                if _movies_high_water is not None and updated_at <= _movies_high_water:
+                    late.add(tmdb_id)
+                if tmdb_id in _loaded_tmdb_ids:
+                    stale.append(tmdb_id)
+                new_rows.append((tmdb_id, title, genres, moods, min_age, release_year, popularity))
+                records.append((tmdb_id, title, overview, poster_url, release_year, rating, popularity, cast))
+                versions[tmdb_id] = updated_at
+
+            if new_rows:
+                reasoner.remove_movies(stale)  # old versions of edited movies, in one write
+                failed = set(reasoner.add_movies(new_rows))
+                loaded = {tmdb_id: version for tmdb_id, version in versions.items() if tmdb_id not in failed}
+                catalogue.upsert(record for record in records if record[0] not in failed)
+                _loaded_tmdb_ids.update(loaded)
+                _movies_loaded_late += len(late - failed)
+                _retry_tmdb_ids.difference_update(loaded)
+                _retry_tmdb_ids.update(failed)
+                # New or edited movies can be similar to anything already liked
+                get_similar_to_liked_cache().clear()
+                updated_count = len([tmdb_id for tmdb_id in stale if tmdb_id in loaded])
+                print(f"Loaded {len(loaded) - updated_count} new and {updated_count} updated movies into Prolog KB (total: {len(_loaded_tmdb_ids)})")
+                if failed:
+                    print(f"{len(failed)} movies failed to load into the Prolog KB; retrying them on the next pass")
+            _movies_high_water = high_water
+        except Exception as e:
+            print(f"Error loading movies into Prolog: {e}")
+
+        # 2. Apply likes and unlikes recorded since the last pass, including
+        # toggles of an existing row (update_or_create keeps its pk but bumps
+        # updated_at), so swipes made through other workers arrive here too.
+        try:
+            likes = WatchHistory.objects.all()
+            if _likes_high_water is not None:
+                likes = likes.filter(updated_at__gte=_since(_likes_high_water))
+            rows = likes.order_by('updated_at').values_list('updated_at', 'liked', 'user_id', 'movie__tmdb_id')
+            changes = {}
+            high_water = _likes_high_water
+            for updated_at, liked, user_id, tmdb_id in rows.iterator(chunk_size=5000):
+                high_water = updated_at if high_water is None else max(high_water, updated_at)
+                if _applied_likes.get((user_id, tmdb_id)) == updated_at:
+                    continue  # This like/unlike is already applied
+                changes.pop((user_id, tmdb_id), None)
+                changes[(user_id, tmdb_id)] = (liked, updated_at)  # the latest state wins, in order
+            added = [pair for pair, (liked, _) in changes.items() if liked]
+            removed = [pair for pair, (liked, _) in changes.items() if not liked]
+            retry = [pair for pair in _retry_likes if pair not in changes]
+            failed = set(reasoner.add_likes(added + retry)) if added or retry else set()
+            _retry_likes.clear()
+            _retry_likes.update(failed)
+            added = [pair for pair in added + retry if pair not in failed]
+            if failed:
+                print(f"{len(failed)} likes failed to load into the Prolog KB; retrying them on the next pass")
+            if changes or added:
+                similar_to_liked = get_similar_to_liked_cache()
+                for user_id, tmdb_id in added:
+                    similar_to_liked.like_added(user_id, tmdb_id)
+                if _likes_high_water is not None:  # nothing to undo on a cold load
+                    for user_id, tmdb_id in removed:
+                        reasoner.remove_like(user_id, tmdb_id)
+                        similar_to_liked.like_removed(user_id, tmdb_id)
+                for user_id in {user_id for user_id, _ in changes} | {user_id for user_id, _ in added}:
+                    bump_likes_generation(user_id)
+                _applied_likes.update((pair, updated_at) for pair, (_, updated_at) in changes.items() if pair not in failed)
+            _likes_high_water = high_water
+        except Exception as e:
+            print(f"Error loading likes into Prolog: {e}")
+
+def get_recommendations(pref_genre, pref_mood, user_age, search_query="", user_id=None):
+    """Full ranked list, hydrated with each movie's DB row."""
+    return hydrate_recommendations(rank_recommendations(pref_genre, pref_mood, user_age, search_query, user_id))
+
+def rank_recommendations(pref_genre, pref_mood, user_age, search_query="", user_id=None):
+    """
+    Ranked {tmdb_id, title, explanation, popularity} entries, without touching the Movie
+    table. The tie-break shuffle happens here, so a stored ranking keeps its order.
+    """
+    pref_genre = pref_genre.strip().lower() if pref_genre else 'any'
+    pref_mood = pref_mood.strip().lower() if pref_mood else 'any'
+    load_prolog_kb() # Ensure KB is ready
+
+    key = None
     try:
-        movies = Movie.objects.all().only('tmdb_id', 'title', 'genres', 'moods', 'min_age', 'release_year', 'popularity')
-        new_count = 0
-        
-        def safe_prolog_atom(s):
-            if not isinstance(s, str):
-                s = str(s)
-            s = s.replace('\\', ' ')
-            s = s.replace('\n', ' ').replace('\r', ' ')
-            # Standard prolog single-quote escaping is two single quotes
-            s = s.replace("'", "''")
-            # Remove characters that might break PySWIP FFI 
-            s = "".join(c for c in s if ord(c) < 128 and c.isprintable())
-            return s.strip()
-
-        for m in movies:
-            if m.tmdb_id in _loaded_tmdb_ids:
-                continue  # Already in Prolog, skip
-            
-            # safely parse lists
-            g_list = m.genres if isinstance(m.genres, list) else []
-            m_list = m.moods if isinstance(m.moods, list) else []
-            
-            genres_str = "[" + ",".join([f"'{safe_prolog_atom(g).lower()}'" for g in g_list]) + "]"
-            moods_str = "[" + ",".join([f"'{safe_prolog_atom(mood).lower()}'" for mood in m_list]) + "]"
-            title = safe_prolog_atom(m.title)
-            
-            try:
-                fact_str = f"movie({m.tmdb_id}, '{title}', {genres_str}, {moods_str}, {m.min_age}, {m.release_year}, {int(m.popularity)})"
-                prolog.assertz(fact_str)
-                _loaded_tmdb_ids.add(m.tmdb_id)
-                new_count += 1
-            except Exception as e:
-                print(f"Failed to assert movie {m.tmdb_id}: '{title}' - error: {e}")
-        
-        if new_count > 0:
-            print(f"Loaded {new_count} new movies into Prolog KB (total: {len(_loaded_tmdb_ids)})")
+        key = recommendation_cache_key(pref_genre, pref_mood, user_age, search_query, user_id)
+        cached = cache.get(key)
+    except Exception as e:
+        print(f"Recommendation cache read failed: {e}")
+        cached = None
+    if cached is not None:
+        print(f"DEBUG: Serving {len(cached)} cached recommendations.")
+        return cached
+
+    ranked, complete = _compute_recommendations(pref_genre, pref_mood, user_age, search_query, user_id)
+    # A pass that hit an engine error would serve its partial (often empty)
+    # result for the whole TTL: only cache complete ones.
+    if key and complete:
+        try:
+            cache.set(key, ranked, timeout=getattr(settings, 'RECOMMENDATION_CACHE_TTL', 300))
+        except Exception as e:
+            print(f"Recommendation cache write failed: {e}")
+    return ranked
+
+def hydrate_recommendations(ranked):
+    """
+    Ranked entries -> API dicts, in order, gathered from the in-memory
+    catalogue. Only movies the catalogue hasn't seen yet (e.g. the KB load
+    failed) cost a query; entries whose movie is gone are dropped.
+    """
+    from .models import Movie
+    if not ranked:
+        return []
+    missing = [m['tmdb_id'] for m in ranked if m.get('tmdb_id') is not None and m['tmdb_id'] not in catalogue]
+    if missing:
+        catalogue.upsert(Movie.objects.filter(tmdb_id__in=missing).values_list(*RECORD_FIELDS))
+
+    final_movies = []
+    for m in ranked:
+        record = catalogue.get(m.get('tmdb_id'))
+        if record:
+            final_movies.append(record.as_recommendation(m["explanation"]))
+    return final_movies
+
+# ── Ranking cursors ──
+# A ranking is stored once under an opaque token; later pages only hydrate their
+# slice. The request parameters are stored with it, so a cursor can't be replayed
+# with a different genre, mood, age or user.
+def store_ranking(ranked, params):
+    token = uuid.uuid4().hex
+    try:
+        cache.set(f"recs:cursor:{token}", {"params": params, "ranked": ranked},
+                  timeout=getattr(settings, 'RECOMMENDATION_CURSOR_TTL', 600))
     except Exception as e:
-        print(f"Error loading movies into Prolog: {e}")
+        print(f"Recommendation cursor write failed: {e}")
+    return token
 
-    # 2. Load User Likes if not already loaded
+def load_ranking(token, params):
+    """The stored ranking, or None once the cursor has expired or was made for other parameters."""
     try:
-        likes = WatchHistory.objects.filter(liked=True)
-        for like in likes:
-            try:
-                check_like = list(prolog.query(f"user_likes({like.user.id}, {like.movie.tmdb_id})"))
-                if not check_like:
-                    prolog.assertz(f"user_likes({like.user.id}, {like.movie.tmdb_id})")
-            except: pass
+        stored = cache.get(f"recs:cursor:{token}")
     except Exception as e:
-        print(f"Error loading likes into Prolog: {e}")
+        print(f"Recommendation cursor read failed: {e}")
+        return None
+    if not isinstance(stored, dict) or stored.get("params") != params:
+        return None
+    return stored["ranked"]
 
-def get_recommendations(pref_genre, pref_mood, user_age, search_query="", user_id=None):
-    pref_genre = pref_genre.lower() if pref_genre else 'any'
-    pref_mood = pref_mood.lower() if pref_mood else 'any'
-    from .models import Movie
-    load_prolog_kb() # Ensure KB is ready
-    chroma_collection = get_chroma_collection()
+def _compute_recommendations(pref_genre, pref_mood, user_age, search_query, user_id):
+    """(ranked entries, complete); complete is False when a step failed and the result is partial."""
     pool_ids = []
+    complete = True
     
     # ── KEYWORD SEARCH POOL (ChromaDB / Local Fallback) ──
     if search_query and search_query.strip():
         search_query_lower = search_query.lower()
         print(f"DEBUG: Searching for '{search_query}'")
         query_embedding = None
+        chroma_collection = get_chroma_collection()
         if chroma_collection:
-             query_embedding = get_openrouter_embedding(search_query)
+             query_embedding = embed_text(search_query)
+             if query_embedding and chroma_collection.dim and len(query_embedding) != chroma_collection.dim:
+                 print(f"DEBUG: Query embedding has {len(query_embedding)} dims but the index has {chroma_collection.dim}. "
+                       "Run 'python manage.py backfill_chroma --reset' after changing EMBEDDING_BACKEND.")
+                 query_embedding = None
         
         if query_embedding and chroma_collection:
-            print("DEBUG: Embedding generated successfully. Querying Chroma DB...")
-            results = chroma_collection.query(
-                query_embeddings=[query_embedding],
-                n_results=100
-            )
-            if results and results.get("ids") and len(results["ids"]) > 0:
-                pool_ids = [int(x) for x in results["ids"][0] if str(x).isdigit()]
-                print(f"DEBUG: Found {len(pool_ids)} matching pool_ids in ChromaDB.")
+            print(f"DEBUG: Embedding ready (cache {get_embedding_cache().stats()}). Querying Chroma DB...")
+            # Pre-filter the vector search with the same hard constraints the
+            # Prolog rules apply, relaxing them in the same order as the
+            # fallbacks below, so the top 100 are all eligible candidates.
+            results = None
+            try:
+                for genre, mood in dict.fromkeys((g, m) for _, g, m in relaxation_tiers(pref_genre, pref_mood)):
+                    results = chroma_collection.query(
+                        query_embeddings=[query_embedding],
+                        n_results=100,
+                        where=build_vector_filter(genre, mood, user_age)
+                    )
+                    if results and results.get("ids") and results["ids"][0]:
+                        break
+            except Exception as e:
+                print(f"DEBUG: Vector search failed ({e}). Falling back to local offline search.")
+                query_embedding = None
+                complete = False
             else:
-                print("DEBUG: ChromaDB returned no results.")
+                if results and results.get("ids") and len(results["ids"]) > 0:
+                    pool_ids = [int(x) for x in results["ids"][0] if str(x).isdigit()]
+                    print(f"DEBUG: Found {len(pool_ids)} matching pool_ids in ChromaDB.")
+                else:
+                    print("DEBUG: ChromaDB returned no results.")
         else:
-            print("DEBUG: Failed to generate AI embedding from OpenRouter. Falling back to local offline search.")
+            print("DEBUG: Failed to generate AI embedding. Falling back to local offline search.")
+
+        if not query_embedding or not chroma_collection:
             from .models import Movie
             from django.db.models import Q
             matching_movies = Movie.objects.filter(
@@ -219,58 +424,42 @@ def get_recommendations(pref_genre, pref_mood, user_age, search_query="", user_i
     # ══════════════════════════════════════════════════════════
     query_results = []
     
+    # One call per request: the rule itself falls back from the exact
+    # genre/mood to relaxed ones and reports the tier it settled on.
+    reasoner = get_reasoner()
     if search_query and search_query.strip():
         # Keyword search — restrict to pool
         if pool_ids:
-            pool_str = "[" + ",".join(map(str, pool_ids)) + "]"
-            query = f"recommend_movie_in_pool('{pref_genre}', '{pref_mood}', {user_age}, {pool_str}, ID, Title, Explanation, Popularity)"
             try:
-                query_results = list(prolog.query(query))
-                
-                # Fallbacks strictly within the semantic pool
-                if not query_results and pref_mood != 'any':
-                    query_results.extend(list(prolog.query(f"recommend_movie_in_pool('{pref_genre}', 'any', {user_age}, {pool_str}, ID, Title, Explanation, Popularity)")))
-                if not query_results and pref_genre != 'any':
-                    query_results.extend(list(prolog.query(f"recommend_movie_in_pool('any', '{pref_mood}', {user_age}, {pool_str}, ID, Title, Explanation, Popularity)")))
-                if not query_results:
-                    query_results.extend(list(prolog.query(f"recommend_movie_in_pool('any', 'any', {user_age}, {pool_str}, ID, Title, Explanation, Popularity)")))
+                query_results = reasoner.recommend(pref_genre, pref_mood, user_age, pool_ids=pool_ids)
             except Exception as e:
                 print(f"Error querying search pool: {e}")
+                complete = False
     else:
         # No search query — global recommendation based on Genre/Mood
-        query = f"recommend_movie('{pref_genre}', '{pref_mood}', {user_age}, ID, Title, Explanation, Popularity)"
         try:
-            query_results = list(prolog.query(query))
-            
-            # Fallbacks evaluated ONLY against query_results
-            if not query_results and pref_mood != 'any':
-                query_results.extend(list(prolog.query(f"recommend_movie('{pref_genre}', 'any', {user_age}, ID, Title, Explanation, Popularity)")))
-            if not query_results and pref_genre != 'any':
-                query_results.extend(list(prolog.query(f"recommend_movie('any', '{pref_mood}', {user_age}, ID, Title, Explanation, Popularity)")))
-            if not query_results:
-                query_results.extend(list(prolog.query(f"recommend_movie('any', 'any', {user_age}, ID, Title, Explanation, Popularity)")))
+            query_results = reasoner.recommend(pref_genre, pref_mood, user_age)
         except Exception as e:
             print(f"Error querying global recommendations: {e}")
+            complete = False
+    if query_results:
+        print(f"DEBUG: Query context matched at relaxation tier {query_results[0].get('Tier')}.")
 
     # ══════════════════════════════════════════════════════════
     # PIPELINE 2: TRAINING CONTEXT (soft ranking signal — never overrides)
     # Swipe likes boost ranking of filter-matching movies only.
     # ══════════════════════════════════════════════════════════
-    training_titles = set()  # Titles the user liked — used for ranking boost only
+    training = None  # Movies similar to what the user liked — used for ranking boost only
     
     if user_id:
         try:
-            collab_query = f"recommend_similar_to_liked({user_id}, {user_age}, ID, Title, Explanation, Popularity)"
-            training_results = list(prolog.query(collab_query))
-            for r in training_results:
-                t = r.get("Title")
-                if t:
-                    title = t.decode('utf-8') if isinstance(t, bytes) else str(t)
-                    training_titles.add(title)
-        except:
-            pass
+            # Materialised per user and kept current on each swipe
+            training = get_similar_to_liked_cache().get(user_id)
+        except Exception as e:
+            print(f"Error loading similar-to-liked set: {e}")
+            complete = False
     
-    print(f"DEBUG: Query context returned {len(query_results)} results. Training context found {len(training_titles)} liked-similar titles.")
+    print(f"DEBUG: Query context returned {len(query_results)} results. Training context found {len(training) if training else 0} liked-similar movies.")
 
     # ══════════════════════════════════════════════════════════
     # MERGE: Query results are primary. Training data only boosts rank.
@@ -278,47 +467,26 @@ def get_recommendations(pref_genre, pref_mood, user_age, search_query="", user_i
     try:
         unique_matches = {}
         for res in query_results:
+            tmdb_id = res.get("ID")
             title_raw = res.get("Title")
-            if not title_raw: continue
+            if tmdb_id is None or not title_raw: continue
             title = title_raw.decode('utf-8') if isinstance(title_raw, bytes) else str(title_raw)
             explanation_raw = res.get("Explanation", "")
             explanation = explanation_raw.decode('utf-8') if isinstance(explanation_raw, bytes) else str(explanation_raw)
             popularity = int(res.get("Popularity", 50))
             
             # SOFT BOOST: If this movie also appears in training context, give it a gentle rank boost
-            if title in training_titles:
+            if training and training.explanation(tmdb_id, user_age) is not None:
                 popularity += 500  # Soft signal, not hard override
                 explanation = explanation + " ⭐ Also matches your watch history!"
             
-            if title not in unique_matches:
-                unique_matches[title] = {"title": title, "explanation": explanation, "popularity": popularity}
+            if tmdb_id not in unique_matches:
+                unique_matches[tmdb_id] = {"tmdb_id": tmdb_id, "title": title, "explanation": explanation, "popularity": popularity}
                 
         import random
         match_list = list(unique_matches.values())
         random.shuffle(match_list) # Shuffle first to break ties randomly
-        sorted_matches = sorted(match_list, key=lambda x: x['popularity'], reverse=True)[:500]
-        
-        # Fetch rich data from DB 
-        titles = [m['title'] for m in sorted_matches]
-        movies_in_db = Movie.objects.filter(title__in=titles)
-        movie_lookup = { m.title: m for m in movies_in_db }
-        
-        final_movies = []
-        for m in sorted_matches:
-            db_m = movie_lookup.get(m['title'])
-            if db_m:
-                final_movies.append({
-                    "title": db_m.title,
-                    "explanation": m["explanation"],
-                    "popularity": db_m.popularity,
-                    "poster_url": db_m.poster_url,
-                    "overview": db_m.overview,
-                    "cast": db_m.cast,
-                    "rating": db_m.rating,
-                    "year": db_m.release_year,
-                    "tmdb_id": db_m.tmdb_id
-                })
-        return final_movies
+        return sorted(match_list, key=lambda x: x['popularity'], reverse=True)[:500], complete
     except Exception as e:
         print(f"Error executing Prolog query: {e}")
-        return []
+        return [], False
@@ -1,26 +1,22 @@
+import hashlib
+import json
 import os
-import requests
 import time
 from celery import shared_task
+from django.db import transaction
+from django.utils import timezone
 from .models import Movie
+from .tmdb import TMDBClient
 from django.conf import settings
+from .bitsets import TMDB_GENRES
 try:
-    from .services import get_openrouter_embedding, get_chroma_collection
+    from .services import get_chroma_collection
 except Exception as e:
     print(f"Failed to import from services in Celery tasks: {e}")
-    get_openrouter_embedding = None
     get_chroma_collection = None
-    print(f"Failed to import get_openrouter_embedding in Celery tasks: {e}")
-    get_openrouter_embedding = None
-
-TMDB_GENRES = {
-    28: 'action', 12: 'adventure', 16: 'animation', 35: 'comedy', 80: 'crime',
-    99: 'documentary', 18: 'drama', 10751: 'family', 14: 'fantasy', 36: 'history',
-    27: 'horror', 10402: 'musical', 9648: 'mystery', 10749: 'romance', 878: 'sci-fi',
-    10770: 'tv movie', 53: 'thriller', 10752: 'war', 37: 'western'
-}
 
 def infer_mood(overview, genres):
+    # Keep bitsets.MOODS in step with the moods produced here
     overview_lower = overview.lower()
     moods = []
     if 'dark' in overview_lower or 'murder' in overview_lower or 'crime' in overview_lower: moods.append('dark')
@@ -38,114 +34,142 @@ def infer_mood(overview, genres):
 def fetch_popular_movies():
     return sync_movies_with_tmdb(max_pages=25)
 
-def sync_movies_with_tmdb(max_pages=25):
+# /movie/popular fields that move daily; refreshed in bulk without re-syncing the movie
+VOLATILE_FIELDS = ['popularity', 'rating']
+
+def tmdb_fingerprint(m):
+    """
+    Hash of the stable /movie/popular fields a Movie row is derived from
+    (everything but popularity and rating). Cast comes from /credits, which
+    is exactly the request a matching fingerprint lets us skip.
+    """
+    stable = [m.get("title", ""), m.get("overview", ""), sorted(m.get("genre_ids", [])),
+              m.get("poster_path"), m.get("release_date"), m.get("adult", False)]
+    return hashlib.sha256(json.dumps(stable).encode('utf-8')).hexdigest()
+
+def volatile_values(m):
+    return {'popularity': float(m.get("popularity", 50)), 'rating': float(m.get("vote_average", 0))}
+
+def movie_defaults(m, cast):
+    """Movie field values for one TMDB /movie/popular result plus its top cast."""
+    title = m.get("title", "")
+    overview = m.get("overview", "")
+
+    # Improved age inference 
+    is_adult = m.get("adult", False)
+    genre_ids = m.get("genre_ids", [])
+    
+    if is_adult:
+        min_age = 18
+    elif 16 in genre_ids or 10751 in genre_ids: # Animation or Family
+        min_age = 0
+    elif 35 in genre_ids: # Comedy
+        min_age = 6
+    else:
+        min_age = 12
+    
+    release_year = int(m.get("release_date", "2000")[:4]) if m.get("release_date") else 2000
+    popularity, rating = volatile_values(m).values()
+    
+    genres = [TMDB_GENRES.get(gid, 'drama') for gid in genre_ids if TMDB_GENRES.get(gid)]
+    if not genres: genres = ['drama']
+    
+    moods = infer_mood(overview, genres)
+    poster_url = f"https://image.tmdb.org/t/p/w500{m['poster_path']}"
+    return {
+        'title': title,
+        'overview': overview,
+        'poster_url': poster_url,
+        'release_year': release_year,
+        'rating': rating,
+        'popularity': popularity,
+        'min_age': min_age,
+        'genres': genres,
+        'moods': moods,
+        'cast': cast,
+        'fingerprint': tmdb_fingerprint(m)
+    }
+
+# Columns rewritten when a synced movie already exists (everything but tmdb_id)
+UPSERT_FIELDS = ['title', 'overview', 'poster_url', 'release_year', 'rating', 'popularity',
+                 'min_age', 'genres', 'moods', 'cast', 'fingerprint', 'updated_at']
+
+def upsert_movies(rows):
+    """
+    Insert or update {tmdb_id: defaults} in one statement and one transaction
+    (bulk_create with ON CONFLICT DO UPDATE). updated_at is stamped, so the
+    Prolog KB picks the rows up on its next incremental load.
+    """
+    if not rows:
+        return 0
+    movies = [Movie(tmdb_id=tmdb_id, **defaults) for tmdb_id, defaults in rows.items()]
+    with transaction.atomic():
+        Movie.objects.bulk_create(movies, update_conflicts=True, unique_fields=['tmdb_id'], update_fields=UPSERT_FIELDS)
+    return len(movies)
+
+def bulk_update_movies(movies, fields, batch_size=500):
+    """
+    Save ``fields`` of already-loaded Movie objects with bulk_update in one
+    transaction, for reclassification scripts. bulk_update skips auto_now,
+    so updated_at is stamped here to keep the KB's incremental load honest.
+    """
+    now = timezone.now()
+    for m in movies:
+        m.updated_at = now
+    with transaction.atomic():
+        Movie.objects.bulk_update(movies, list(fields) + ['updated_at'], batch_size=batch_size)
+    return len(movies)
+
+def sync_movies_with_tmdb(max_pages=25, client=None, resume=False, full=False):
+    """
+    Crawl TMDB's popular list through the staged ingest pipeline (see ingest.py).
+    With ``resume``, continue after the last page the previous run stored and
+    first index the movies it left without vectors. Unless ``full``, movies
+    whose fingerprint is unchanged only get popularity/rating refreshed.
+    """
+    from .ingest import IngestPipeline, Checkpoint
     api_key = os.getenv("TMDB_API_KEY")
-    if not api_key:
+    if client is None and not api_key:
         print("No TMDB API key, skipping.")
         return 0
 
     # Initialize chromadb client and model
     collection = None
-    if get_openrouter_embedding is not None and get_chroma_collection is not None:
+    if get_chroma_collection is not None:
         try:
             collection = get_chroma_collection()
         except Exception as e:
             print(f"Error initializing ChromaDB: {e}")
 
-    print(f"Syncing {max_pages} pages of movies from TMDB...")
-    
-    new_movies_processed = 0
-    embedding_disabled = False  # Circuit breaker: stop trying embeddings after first failure
-    
-    for page in range(1, max_pages + 1):
-        url = f"https://api.themoviedb.org/3/movie/popular?api_key={api_key}&language=en-US&page={page}"
-        try:
-            response = requests.get(url, timeout=10).json()
-            movies_data = response.get("results", [])
-            for m in movies_data:
-                movie_id = m["id"]
-                title = m.get("title", "")
-                overview = m.get("overview", "")
-                
-                if not m.get("poster_path") or title.lower() in ["the orphans", "orphans"]:
-                    continue
-                
-                # Fetch credits for this movie to get cast
-                credits_url = f"https://api.themoviedb.org/3/movie/{movie_id}/credits?api_key={api_key}"
-                credits_resp = requests.get(credits_url, timeout=10).json()
-                
-                # Safety throttle: TMDB has a 40 reqs / 10s limit. 
-                # With 0.25s sleep + processing time, we stay well within safety.
-                time.sleep(0.25)
-                
-                cast = [actor["name"] for actor in credits_resp.get("cast", [])[:5]]
+    checkpoint_path = getattr(settings, 'INGEST_CHECKPOINT_PATH', os.path.join(settings.BASE_DIR, 'ingest_checkpoint.json'))
+    # Pending embeddings always carry over; only --resume keeps the crawl position
+    checkpoint = Checkpoint.load(checkpoint_path)
+    if not resume:
+        checkpoint.last_page = 0
+    first_page = checkpoint.last_page + 1
+    if first_page > 1:
+        print(f"Resuming after page {checkpoint.last_page} ({len(checkpoint.pending)} movies awaiting embeddings).")
+    print(f"Syncing pages {first_page}-{max_pages} of movies from TMDB...")
 
-                # Improved age inference 
-                is_adult = m.get("adult", False)
-                genre_ids = m.get("genre_ids", [])
-                
-                if is_adult:
-                    min_age = 18
-                elif 16 in genre_ids or 10751 in genre_ids: # Animation or Family
-                    min_age = 0
-                elif 35 in genre_ids: # Comedy
-                    min_age = 6
-                else:
-                    min_age = 12
-                
-                release_year = int(m.get("release_date", "2000")[:4]) if m.get("release_date") else 2000
-                popularity = float(m.get("popularity", 50))
-                rating = float(m.get("vote_average", 0))
-                
-                genre_ids = m.get("genre_ids", [])
-                genres = [TMDB_GENRES.get(gid, 'drama') for gid in genre_ids if TMDB_GENRES.get(gid)]
-                if not genres: genres = ['drama']
-                
-                moods = infer_mood(overview, genres)
-                poster_url = f"https://image.tmdb.org/t/p/w500{m['poster_path']}"
-                
-                movie_obj, created = Movie.objects.update_or_create(
-                    tmdb_id=movie_id,
-                    defaults={
-                        'title': title,
-                        'overview': overview,
-                        'poster_url': poster_url,
-                        'release_year': release_year,
-                        'rating': rating,
-                        'popularity': popularity,
-                        'min_age': min_age,
-                        'genres': genres,
-                        'moods': moods,
-                        'cast': cast
-                    }
-                )
-                
-                # Only attempt embeddings if they haven't already failed
-                if collection and get_openrouter_embedding and not embedding_disabled:
-                    text_for_embedding = f"Title: {title}. Genres: {', '.join(genres)}. Cast: {', '.join(cast)}. Overview: {overview}"
-                    embedding = get_openrouter_embedding(text_for_embedding)
-                    
-                    if embedding:
-                        collection.upsert(
-                            documents=[text_for_embedding],
-                            embeddings=[embedding],
-                            metadatas=[{"tmdb_id": movie_id, "title": title}],
-                            ids=[str(movie_id)]
-                        )
-                    else:
-                        # Circuit breaker: embedding failed (likely 401/no credits).
-                        # Stop wasting API calls — movies still save to DB fine.
-                        embedding_disabled = True
-                        print("⚠️  OpenRouter embedding failed. Disabling embeddings for the rest of this sync.")
-                        print("   (Movies will still be saved to the database. Local keyword search will work.)")
-                        
-                new_movies_processed += 1
-                
-        except Exception as e:
-            print(f"Error loading TMDB movies page {page}: {e}")
+    # Pages and credits are fetched concurrently; the client's shared token
+    # bucket keeps us within TMDB's request budget (TMDB_RATE_LIMIT).
+    tmdb = client or TMDBClient(api_key)
+    pipeline = IngestPipeline(tmdb, checkpoint, collection=collection,
+                              queue_size=getattr(settings, 'INGEST_QUEUE_SIZE', 4), delta=not full)
+    started = time.perf_counter()
+    try:
+        new_movies_processed = pipeline.run(range(first_page, max_pages + 1))
+    finally:
+        if client is None:
+            tmdb.close()
+    elapsed = time.perf_counter() - started
 
-    print(f"Finished processing {new_movies_processed} movies.")
-    if embedding_disabled:
+    print(pipeline.report())
+    print(f"Finished processing {new_movies_processed} movies in {elapsed:.1f}s.")
+    if pipeline.unchanged:
+        print(f"Skipped {pipeline.unchanged} unchanged movies; refreshed popularity/rating on {pipeline.refreshed} of them.")
+    if checkpoint.last_page >= max_pages and not checkpoint.pending:
+        checkpoint.clear()  # crawl complete: nothing to resume
+    if pipeline.embedding_disabled:
         print("Note: Embeddings were skipped. Run 'python manage.py backfill_chroma' later when your API key is valid.")
     return new_movies_processed
-
@@ -1,3 +1,331 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from io import StringIO
 
-# Create your tests here.
+import numpy as np
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from .ingest import Checkpoint, IngestPipeline
+from .models import Movie
+from .reasoning import NumpyReasoner, SimilarToLikedCache, relaxation_tiers, construct_explanation
+from .services import ranking_params, store_ranking, load_ranking
+from .tasks import tmdb_fingerprint
+from .vector_store import SimpleVectorDB
+
+# (tmdb_id, title, genres, moods, min_age, release_year, popularity)
+MOVIES = [
+    (1, "Night Run", ['Action', 'thriller'], ['tense'], 13, 2001, 100),
+    (2, "Laugh Track", ['comedy'], ['funny'], 6, 2005, 50),
+    (3, "Deep Space", ['sci-fi', 'action'], ['mind-bending', 'tense'], 12, 2010, 80),
+    (4, "Grown Ups Only", ['action'], ['tense'], 18, 2012, 10),
+]
+
+
+def _swi_prolog_available():
+    try:
+        import pyswip  # noqa: F401 (fails without a usable libswipl)
+    except Exception:
+        return False
+    return True
+
+
+# ── Reasoning ──────────────────────────────────────────
+
+class NumpyReasonerTests(SimpleTestCase):
+    def setUp(self):
+        self.reasoner = NumpyReasoner()
+        self.reasoner.add_movies(MOVIES)
+
+    def ids(self, results):
+        return [r["ID"] for r in results]
+
+    def test_relaxation_tiers(self):
+        self.assertEqual(relaxation_tiers('action', 'tense'),
+                         [(0, 'action', 'tense'), (1, 'action', 'any'), (2, 'any', 'tense'), (3, 'any', 'any')])
+        self.assertEqual(relaxation_tiers('action', 'any'), [(0, 'action', 'any'), (2, 'any', 'any'), (3, 'any', 'any')])
+        self.assertEqual(relaxation_tiers('any', 'any'), [(0, 'any', 'any')])
+
+    def test_exact_match_respects_age(self):
+        results = self.reasoner.recommend('action', 'tense', 16)
+        self.assertEqual(self.ids(results), [1, 3])
+        self.assertEqual({r["Tier"] for r in results}, {0})
+        self.assertEqual(results[0]["Explanation"], construct_explanation('action', 'tense', 13))
+        self.assertEqual(self.ids(self.reasoner.recommend('action', 'tense', 18)), [1, 3, 4])
+
+    def test_relaxes_mood_then_genre_then_both(self):
+        results = self.reasoner.recommend('comedy', 'tense', 16)
+        self.assertEqual((self.ids(results), results[0]["Tier"]), ([2], 1))
+        self.assertEqual(results[0]["Explanation"], construct_explanation('comedy', 'any', 6))
+        results = self.reasoner.recommend('horror', 'tense', 16)
+        self.assertEqual((self.ids(results), results[0]["Tier"]), ([1, 3], 2))
+        results = self.reasoner.recommend('horror', 'romantic', 16)
+        self.assertEqual((self.ids(results), results[0]["Tier"]), ([1, 2, 3], 3))
+        self.assertEqual(self.reasoner.recommend('horror', 'romantic', -1), [])
+
+    def test_pool_keeps_pool_order_and_relaxes_within_it(self):
+        self.assertEqual(self.ids(self.reasoner.recommend('action', 'any', 16, pool_ids=[3, 99, 1])), [3, 1])
+        results = self.reasoner.recommend('action', 'tense', 16, pool_ids=[2])
+        self.assertEqual((self.ids(results), results[0]["Tier"]), ([2], 3))
+
+    def test_edit_moves_movie_to_the_end(self):
+        self.reasoner.remove_movie(2)
+        self.reasoner.add_movies([(1, "Night Run (edited)", ['action'], ['tense'], 13, 2001, 100)])
+        results = self.reasoner.recommend('any', 'any', 16)
+        self.assertEqual(self.ids(results), [3, 1])
+        self.assertEqual(results[1]["Title"], "Night Run (edited)")
+
+    def test_similar_to_liked(self):
+        self.reasoner.add_likes([(7, 1)])
+        results = self.reasoner.similar_to_liked(7, 16)
+        self.assertEqual(self.ids(results), [3])
+        self.assertEqual(results[0]["Explanation"],
+                         "Recommended because you liked Night Run, which shares the action genre and tense vibe.")
+        self.assertEqual(self.ids(self.reasoner.similar_to_liked(7, 18)), [3, 4])
+        self.assertEqual(self.reasoner.similar_to_liked(8, 18), [])
+
+    def test_similar_to_liked_cache_follows_likes(self):
+        cache = SimilarToLikedCache(self.reasoner)
+        self.reasoner.add_likes([(7, 1)])
+        self.assertIsNotNone(cache.get(7).explanation(3, 16))
+        self.assertIsNone(cache.get(7).explanation(4, 16))  # too young
+        self.assertIsNotNone(cache.get(7).explanation(4, 18))
+
+        self.reasoner.remove_like(7, 1)
+        cache.like_removed(7, 1)
+        self.assertIsNone(cache.get(7).explanation(3, 16))
+        self.reasoner.add_likes([(7, 1)])
+        cache.like_added(7, 1)
+        self.assertIsNotNone(cache.get(7).explanation(3, 16))
+
+
+@unittest.skipUnless(_swi_prolog_available(), "SWI-Prolog (pyswip) is not available")
+class PrologNumpyComparisonTests(SimpleTestCase):
+    def test_reasoners_agree_on_synthetic_catalogue(self):
+        # Raises CommandError on any differing result or explanation
+        call_command('compare_reasoners', synthetic=200, pools=1, stdout=StringIO())
+
+
+# ── Vector store ──────────────────────────────────────────
+
+class SimpleVectorDBTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='vector_store_test_')
+        self.path = os.path.join(self.dir, 'store.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def upsert(self, store, ids, vectors, metadatas=None):
+        store.upsert(documents=[f"doc {i}" for i in ids], embeddings=vectors,
+                     metadatas=metadatas or [{} for _ in ids], ids=ids)
+
+    def nearest(self, store, vector, **kwargs):
+        return store.query([vector], n_results=1, **kwargs)["ids"][0]
+
+    def files(self):
+        return sorted(os.listdir(self.dir))
+
+    def test_upsert_and_query(self):
+        store = SimpleVectorDB(self.path)
+        self.upsert(store, ["a", "b"], np.eye(2, 4))
+        self.assertEqual(self.nearest(store, [1, 0, 0, 0]), ["a"])
+        self.upsert(store, ["a"], [[0, 0, 1, 0]])  # an update supersedes the old row
+        self.assertEqual(store.count(), 2)
+        self.assertEqual(self.nearest(store, [0, 0, 1, 0]), ["a"])
+        with self.assertRaises(ValueError):
+            self.upsert(store, ["c"], [[1, 0]])
+
+    def test_reopen_and_refresh_see_other_writers(self):
+        writer = SimpleVectorDB(self.path)
+        self.upsert(writer, ["a"], [[1, 0, 0]])
+        reader = SimpleVectorDB(self.path)
+        self.assertEqual(reader.count(), 1)
+
+        self.upsert(writer, ["b"], [[0, 1, 0]])
+        self.assertTrue(reader.refresh())
+        self.assertEqual(self.nearest(reader, [0, 1, 0]), ["b"])
+        self.assertFalse(reader.refresh())
+
+        writer.compact()
+        self.upsert(writer, ["c"], [[0, 0, 1]])
+        self.assertTrue(reader.refresh())
+        self.assertEqual(reader.count(), 3)
+        self.assertEqual(self.nearest(reader, [0, 0, 1]), ["c"])
+
+    def test_compact_keeps_live_rows_and_drops_old_generations(self):
+        store = SimpleVectorDB(self.path)
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(20, 8)).astype(np.float32)
+        self.upsert(store, [str(i) for i in range(20)], vectors)
+        for _ in range(3):  # superseded rows pile up in the .f32 file
+            vectors[:10] = rng.normal(size=(10, 8))
+            self.upsert(store, [str(i) for i in range(10)], vectors[:10])
+        self.assertEqual(len(store.ids), 50)
+
+        store.compact()
+        self.assertEqual(len(store.ids), 20)
+        generation = store.generation
+        self.assertEqual(self.files(), sorted([
+            'store.lock', 'store.meta.json', f'store.{generation}.f32', f'store.{generation}.wal.jsonl']))
+
+        reopened = SimpleVectorDB(self.path)
+        self.assertEqual(reopened.count(), 20)
+        for i in (0, 9, 10, 19):
+            self.assertEqual(self.nearest(reopened, vectors[i]), [str(i)])
+
+    def test_compaction_leftovers_are_ignored_then_removed(self):
+        # A writer that died after writing the next generation, before
+        # publishing the meta, leaves files no snapshot refers to.
+        store = SimpleVectorDB(self.path)
+        self.upsert(store, ["a"], [[1, 0]])
+        orphan = os.path.join(self.dir, f'store.{store.generation + 1}.f32')
+        np.zeros((5, 2), dtype=np.float32).tofile(orphan)
+
+        reopened = SimpleVectorDB(self.path)
+        self.assertEqual(reopened.count(), 1)
+        reopened.compact()
+        reopened.compact()  # the second generation overwrites then drops the orphan
+        self.assertEqual(reopened.count(), 1)
+        self.assertNotIn(f'store.{store.generation + 1}.f32', self.files())
+        self.assertEqual(len([f for f in self.files() if f.endswith('.f32')]), 1)
+
+    def test_migrates_legacy_json_once(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({"ids": [1, 2], "documents": ["one", "two"], "metadatas": [{"year": 2001}, {"year": 2002}],
+                       "embeddings": [[1.0, 0.0], [0.0, 1.0]]}, f)
+        store = SimpleVectorDB(self.path)
+        self.assertEqual(store.count(), 2)
+        self.assertEqual(self.nearest(store, [0, 1]), ["2"])
+        self.assertTrue(os.path.exists(store.meta_path))
+
+        self.upsert(store, ["3"], [[1, 1]])
+        self.assertEqual(SimpleVectorDB(self.path).count(), 3)  # not migrated again over the new row
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_reads_and_upgrades_pre_generation_layout(self):
+        base = os.path.join(self.dir, 'store')
+        np.eye(2, dtype=np.float32).tofile(base + '.f32')
+        with open(base + '.meta.json', 'w', encoding='utf-8') as f:
+            json.dump({"generation": 3, "dim": 2, "ids": ["a", "b"], "documents": ["", ""], "metadatas": [{}, {}]}, f)
+        with open(base + '.wal.jsonl', 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"g": 3, "row": 2, "id": "a", "document": "", "metadata": {}, "dim": 2}) + "\n")
+        with open(base + '.f32', 'ab') as f:
+            np.array([[-1.0, 0.0]], dtype=np.float32).tofile(f)
+
+        store = SimpleVectorDB(self.path)
+        self.assertEqual(store.count(), 2)
+        self.assertEqual(self.nearest(store, [-1, 0]), ["a"])  # the WAL update won
+
+        store.compact()
+        self.assertNotIn('store.f32', self.files())
+        self.assertNotIn('store.wal.jsonl', self.files())
+        self.assertEqual(self.nearest(SimpleVectorDB(self.path), [-1, 0]), ["a"])
+
+    def test_where_filters(self):
+        store = SimpleVectorDB(self.path)
+        self.upsert(store, ["a", "b", "c", "d"], [[1, 0], [0.9, 0.1], [0.8, 0.2], [0.7, 0.3]], [
+            {"year": 2001, "genres": ["action"]},
+            {"year": 2005, "genres": ["comedy", "action"]},
+            {"year": 2010, "genres": ["drama"]},
+            {},  # written before the fields existed: kept by every filter
+        ])
+
+        def ids(where):
+            return store.query([[1, 0]], n_results=10, where=where)["ids"][0]
+
+        self.assertEqual(ids({"year": 2005}), ["b", "d"])
+        self.assertEqual(ids({"year": {"$gte": 2005}}), ["b", "c", "d"])
+        self.assertEqual(ids({"year": {"$in": [2001, 2010]}}), ["a", "c", "d"])
+        self.assertEqual(ids({"genres": {"$contains": "action"}}), ["a", "b", "d"])
+        self.assertEqual(ids({"$and": [{"genres": {"$contains": "action"}}, {"year": {"$gt": 2001}}]}), ["b", "d"])
+        self.assertEqual(ids({"$or": [{"year": {"$lt": 2002}}, {"genres": {"$contains": "drama"}}]}), ["a", "c", "d"])
+        self.assertEqual(ids({"rating": {"$gt": 5}}), ["a", "b", "c", "d"])
+        self.assertEqual(ids({"genres": {"$contains": "horror"}}), ["d"])
+
+    def test_ivf_trains_off_the_query_path(self):
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(16, 16)).astype(np.float32)
+        vectors = centers[rng.integers(16, size=2000)] + rng.normal(scale=0.1, size=(2000, 16)).astype(np.float32)
+        store = SimpleVectorDB(self.path, index_type='ivf', ivf_nlist=16, ivf_nprobe=4)
+        self.upsert(store, [str(i) for i in range(2000)], vectors)
+
+        # The first query is answered exactly while the cells are fitted in the background
+        self.assertEqual(self.nearest(store, vectors[5]), ["5"])
+        training = store._training
+        if training is not None:
+            training.join()
+        store.train_index()
+        self.assertIsNotNone(store._ivf.centroids)
+        self.assertIsNotNone(store._ivf_lists())
+        self.assertEqual(self.nearest(store, vectors[7]), ["7"])
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'store.ivf.npz')))
+
+
+# ── Cursor pagination ──────────────────────────────────────────
+
+class RankingCursorTests(SimpleTestCase):
+    def test_params_are_normalised(self):
+        self.assertEqual(ranking_params(" Action ", None, "16", "  Space   Opera ", 3),
+                         ['action', 'any', 16, 'space opera', '3'])
+
+    def test_cursor_is_bound_to_its_parameters(self):
+        params = ranking_params('action', 'tense', 16, '', 3)
+        ranked = [{"tmdb_id": 1}, {"tmdb_id": 2}]
+        token = store_ranking(ranked, params)
+        self.assertEqual(load_ranking(token, params), ranked)
+        self.assertIsNone(load_ranking(token, ranking_params('action', 'tense', 18, '', 3)))
+        self.assertIsNone(load_ranking(token, ranking_params('action', 'tense', 16, '', 4)))
+        self.assertIsNone(load_ranking('no-such-token', params))
+
+
+# ── Ingest delta ──────────────────────────────────────────
+
+class _FakeCollection:
+    def __init__(self, ids):
+        self.ids = {str(i) for i in ids}
+
+    def has(self, _id):
+        return str(_id) in self.ids
+
+
+class IngestDeltaTests(TestCase):
+    def tmdb(self, tmdb_id, title, popularity=10.0):
+        return {"id": tmdb_id, "title": title, "overview": "", "genre_ids": [28], "poster_path": f"/{tmdb_id}.jpg",
+                "release_date": "2001-01-01", "adult": False, "popularity": popularity, "vote_average": 7.0}
+
+    def stored(self, m):
+        return Movie.objects.create(tmdb_id=m["id"], title=m["title"], fingerprint=tmdb_fingerprint(m),
+                                    popularity=m["popularity"], rating=m["vote_average"])
+
+    def test_only_changed_or_unindexed_movies_continue(self):
+        unchanged = self.tmdb(1, "Same")
+        edited = self.tmdb(2, "Old title")
+        no_vector = self.tmdb(3, "Never embedded")
+        for m in (unchanged, edited, no_vector):
+            self.stored(m)
+        new = self.tmdb(4, "New")
+        pipeline = IngestPipeline(client=None, checkpoint=Checkpoint(None), collection=_FakeCollection([1, 2]))
+
+        page, changed = pipeline._delta((1, [unchanged, dict(edited, title="New title"), no_vector, new]))
+        self.assertEqual((page, [m["id"] for m in changed]), (1, [2, 3, 4]))
+        self.assertEqual(pipeline.unchanged, 1)
+
+    def test_unchanged_movie_gets_popularity_refreshed(self):
+        m = self.tmdb(1, "Same")
+        self.stored(m)
+        pipeline = IngestPipeline(client=None, checkpoint=Checkpoint(None), collection=_FakeCollection([1]))
+
+        _, changed = pipeline._delta((1, [dict(m, popularity=99.0)]))
+        self.assertEqual(changed, [])
+        self.assertEqual(pipeline.refreshed, 1)
+        self.assertEqual(Movie.objects.get(tmdb_id=1).popularity, 99.0)
+
+    def test_without_delta_everything_continues(self):
+        m = self.tmdb(1, "Same")
+        self.stored(m)
+        pipeline = IngestPipeline(client=None, checkpoint=Checkpoint(None), collection=_FakeCollection([1]), delta=False)
+        self.assertEqual(pipeline._delta((1, [m]))[1], [m])
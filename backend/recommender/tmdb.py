@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+TMDB_API_URL = "https://api.themoviedb.org/3"
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. ``for_budget(n, period)`` sizes it so that no
+    window of ``period`` seconds ever sees more than ``n`` acquisitions: a
+    small burst allowance plus a steady refill for the rest of the budget.
+    """
+
+    def __init__(self, capacity, fill_rate):
+        self.capacity = float(capacity)
+        self.fill_rate = float(fill_rate)  # tokens per second
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_budget(cls, requests_per_period, period):
+        burst = max(1, requests_per_period // 10)
+        return cls(burst, (requests_per_period - burst) / period)
+
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.fill_rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.fill_rate
+            time.sleep(wait)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_tmdb_limiter():
+    """Process-wide bucket: every client shares TMDB's per-key request budget."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = TokenBucket.for_budget(
+                getattr(settings, 'TMDB_RATE_LIMIT', 40),
+                getattr(settings, 'TMDB_RATE_PERIOD', 10),
+            )
+        return _limiter
+
+
+class TMDBClient:
+    """
+    TMDB v3 client for the sync: one pooled keep-alive session, every request
+    paced by the shared token bucket, and a page's credits fetched by up to
+    ``max_workers`` threads at a time. A 429 is retried after its Retry-After.
+    """
+
+    def __init__(self, api_key=None, base_url=None, limiter=None, max_workers=None, timeout=10, max_retries=3):
+        self.api_key = api_key if api_key is not None else os.getenv("TMDB_API_KEY")
+        self.base_url = (base_url or getattr(settings, 'TMDB_API_URL', TMDB_API_URL)).rstrip('/')
+        self.limiter = limiter or get_tmdb_limiter()
+        self.max_workers = max_workers or getattr(settings, 'TMDB_MAX_WORKERS', 8)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    def get(self, path, **params):
+        params["api_key"] = self.api_key
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            response = self.session.get(f"{self.base_url}{path}", params=params, timeout=self.timeout)
+            if response.status_code == 429 and attempt < self.max_retries:
+                time.sleep(float(response.headers.get("Retry-After", 1)))
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    def popular_page(self, page):
+        return self.get("/movie/popular", language="en-US", page=page).get("results", [])
+
+    def cast(self, movie_id, limit=5):
+        credits = self.get(f"/movie/{movie_id}/credits")
+        return [actor["name"] for actor in credits.get("cast", [])[:limit]]
+
+    def _map(self, fn, items):
+        """fn over items on the worker threads, yielding (item, result or exception) in input order."""
+        def call(item):
+            try:
+                return item, fn(item)
+            except Exception as e:
+                return item, e
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            yield from executor.map(call, items)
+
+    def casts(self, movie_ids):
+        """movie_id -> top cast names, fetched concurrently. Failed lookups are left out."""
+        casts = {}
+        for movie_id, result in self._map(self.cast, list(movie_ids)):
+            if isinstance(result, Exception):
+                print(f"Error fetching credits for movie {movie_id}: {result}")
+            else:
+                casts[movie_id] = result
+        return casts
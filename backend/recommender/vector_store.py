@@ -0,0 +1,802 @@
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from . import bitsets
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are not serialised across processes
+    fcntl = None
+
+
+class SimpleVectorDB:
+    """
+    Small file-backed vector store exposing the subset of the ChromaDB
+    collection API we use (upsert / query / count).
+
+    Storage layout for a store created with path ``<base>.json``:
+      <base>.meta.json      snapshot: ids, documents, metadatas, the dimension
+                            and the generation's two files below
+      <base>.<G>.f32        raw row-major float32 embeddings, opened with np.memmap
+      <base>.<G>.wal.jsonl  append-only log of upserts since snapshot G
+      <base>.lock           held (flock) by whichever process is writing
+
+    Writes never rewrite existing data: new and updated vectors are appended
+    to the .f32 file and described by one WAL line each. An update leaves its
+    old row behind as garbage; ``compact()`` (run automatically once the WAL
+    gets long) rewrites the live rows into the files of a new generation and
+    publishes them by replacing the meta file last, so a crash at any point
+    leaves either the old snapshot or the new one, never a mix. Files of
+    older generations are deleted afterwards. (Stores written before
+    generations had their own files use ``<base>.f32`` / ``<base>.wal.jsonl``
+    until their next compaction.)
+
+    Older deployments kept everything in ``<base>.json`` as nested JSON lists.
+    That file is migrated once into the layout above and then left untouched.
+
+    One instance is meant to live for the whole process (see
+    ``services.get_chroma_collection``). ``refresh()`` picks up writes made by
+    other processes, e.g. a Celery sync: new WAL lines are replayed
+    incrementally, a new snapshot triggers a full reload.
+    """
+
+    # Compact once the log holds this many records, or more than the live rows.
+    COMPACT_MIN_WAL_RECORDS = 1000
+    # Rows decompressed at a time when scanning a quantized matrix.
+    CHUNK_ROWS = 4096
+    STORAGE_DTYPES = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+
+    def __init__(self, path, index_type='exact', ivf_nlist=None, ivf_nprobe=8, storage_dtype='float32', rerank=200):
+        self.base = os.path.splitext(str(path))[0]
+        self.legacy_path = self.base + ".json"
+        self.meta_path = self.base + ".meta.json"
+        self.vectors_path, self.wal_path = self.base + ".f32", self.base + ".wal.jsonl"
+        self.lock_path = self.base + ".lock"
+
+        # 'exact' scans every vector; 'ivf' probes a few k-means cells.
+        self.index_type = index_type
+        self._ivf = IVFIndex(self.base + ".ivf.npz", nlist=ivf_nlist, nprobe=ivf_nprobe) if index_type == 'ivf' else None
+        # In-memory precision of the searchable matrix. The .f32 file is always
+        # full precision and is only read back to re-rank the shortlist.
+        if storage_dtype not in self.STORAGE_DTYPES:
+            raise ValueError(f"Unknown vector storage dtype {storage_dtype!r}")
+        self.storage_dtype = self.STORAGE_DTYPES[storage_dtype]
+        self.rerank = rerank
+
+        self._lock = threading.RLock()
+        self._file_lock_depth = 0
+        self._file_lock_handle = None
+        self._batch_depth = 0
+        self._pending = []
+        self._training = None  # background IVF training thread, while one runs
+        self._reset()
+
+        with self._lock, self._writer_lock():
+            if not os.path.exists(self.meta_path) and os.path.exists(self.legacy_path):
+                self._migrate_legacy()
+            self._load()
+
+    def _reset(self):
+        self.dim = 0
+        # Per physical row of the .f32 file (including superseded rows)
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        # Live id -> physical row
+        self._row = {}
+        self.embeddings = np.zeros((0, 0), dtype=np.float32)
+        # IVF cell per physical row, -1 until assigned
+        self._labels = np.zeros(0, dtype=np.int32)
+        self.generation = 0
+        self._wal_records = 0
+        self._wal_offset = 0
+        self._meta_stamp = None
+        self._invalidate()
+
+    def _invalidate(self):
+        self._live_rows = None
+        self._compressed = None
+        self._columns = {}
+        self._lists = None
+
+    # ── Persistence ──────────────────────────────────────────
+
+    @contextmanager
+    def _writer_lock(self):
+        """
+        Exclusive lock across processes for anything that appends to or
+        rewrites the files, so two writers never interleave. Re-entrant within
+        one instance; callers must already hold ``self._lock``.
+        """
+        if fcntl is None:
+            yield
+            return
+        if self._file_lock_depth == 0:
+            self._file_lock_handle = open(self.lock_path, 'a')
+            fcntl.flock(self._file_lock_handle, fcntl.LOCK_EX)
+        self._file_lock_depth += 1
+        try:
+            yield
+        finally:
+            self._file_lock_depth -= 1
+            if self._file_lock_depth == 0:
+                fcntl.flock(self._file_lock_handle, fcntl.LOCK_UN)
+                self._file_lock_handle.close()
+                self._file_lock_handle = None
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            st = os.stat(path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _generation_paths(self, generation):
+        return f"{self.base}.{generation}.f32", f"{self.base}.{generation}.wal.jsonl"
+
+    def _load(self, attempts=3):
+        for _ in range(attempts):
+            stamp = self._stamp(self.meta_path)
+            if stamp is None:
+                return
+            try:
+                with open(self.meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except Exception as e:
+                print(f"Failed to read vector store metadata {self.meta_path}: {e}")
+                return
+
+            self._reset()
+            self.dim = int(meta.get("dim", 0))
+            self.ids = [str(i) for i in meta.get("ids", [])]
+            self.documents = meta.get("documents", [])
+            self.metadatas = meta.get("metadatas", [])
+            self._row = {_id: i for i, _id in enumerate(self.ids)}
+            self.generation = int(meta.get("generation", 0))
+            directory = os.path.dirname(self.meta_path)
+            self.vectors_path = os.path.join(directory, meta.get("vectors", os.path.basename(self.base) + ".f32"))
+            self.wal_path = os.path.join(directory, meta.get("wal", os.path.basename(self.base) + ".wal.jsonl"))
+            self._meta_stamp = stamp
+            try:
+                self._replay_wal()
+                return
+            except FileNotFoundError:
+                # A writer published a newer snapshot and deleted this one's
+                # vectors between our reading the meta and opening them.
+                continue
+        print(f"Vector store {self.meta_path} kept changing while loading; leaving it empty until the next refresh")
+        self._reset()
+
+    def _replay_wal(self):
+        """Apply WAL records written after ``self._wal_offset``."""
+        try:
+            with open(self.wal_path, 'rb') as f:
+                f.seek(self._wal_offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            chunk = b""
+
+        # Only consume complete lines; a writer may be mid-append.
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            # Records from before the current snapshot were already compacted.
+            if rec.get("g") != self.generation:
+                continue
+            row = int(rec["row"])
+            while len(self.ids) <= row:
+                self.ids.append(None)
+                self.documents.append(None)
+                self.metadatas.append(None)
+            self.ids[row] = rec["id"]
+            self.documents[row] = rec.get("document")
+            self.metadatas[row] = rec.get("metadata")
+            self._row[rec["id"]] = row
+            self.dim = self.dim or int(rec.get("dim", 0))
+            self._wal_records += 1
+        self._wal_offset += end
+
+        if end or len(self.embeddings) != len(self.ids):
+            self.embeddings = self._open_vectors(len(self.ids))
+            self._invalidate()
+        return end > 0
+
+    def _open_vectors(self, rows):
+        if rows == 0 or self.dim == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        # Read-only mapping: pages are shared with the OS cache and only
+        # touched when a query actually scans them.
+        return np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+
+    def refresh(self):
+        """Catch up with writes made by other processes. Returns True if anything changed."""
+        with self._lock:
+            stamp = self._stamp(self.meta_path)
+            if stamp is None:
+                return False
+            if stamp != self._meta_stamp:
+                previous = self.generation
+                self._load()
+                print(f"Reloaded vector store (generation {previous} -> {self.generation}, {self.count()} vectors)")
+                return True
+            try:
+                return self._replay_wal()
+            except FileNotFoundError:
+                # Compacted away since the stamp check: the new meta is there now.
+                self._load()
+                return True
+
+    def _migrate_legacy(self):
+        try:
+            with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+        except Exception as e:
+            print(f"Failed to read legacy vector store {self.legacy_path}: {e}")
+            return
+
+        embeddings = legacy.get("embeddings") or []
+        ids = [str(i) for i in legacy.get("ids", [])]
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        self.dim = matrix.shape[1] if len(embeddings) else 0
+        self._write_snapshot(ids, legacy.get("documents", []), legacy.get("metadatas", []), matrix)
+        print(f"Migrated {len(ids)} vectors from {self.legacy_path} to {self.meta_path}")
+
+    def _write_snapshot(self, ids, documents, metadatas, matrix):
+        """
+        Write ``matrix`` and an empty WAL as the next generation, then publish
+        them with an atomic replace of the meta file. Callers reload after.
+        """
+        generation = self.generation + 1
+        vectors_path, wal_path = self._generation_paths(generation)
+        with open(vectors_path, 'wb') as f:
+            f.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        open(wal_path, 'wb').close()
+
+        tmp_meta = self.meta_path + ".tmp"
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump({
+                "generation": generation,
+                "dim": self.dim,
+                "vectors": os.path.basename(vectors_path),
+                "wal": os.path.basename(wal_path),
+                "ids": ids,
+                "documents": documents,
+                "metadatas": metadatas,
+            }, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_meta, self.meta_path)
+
+        # Drop our mapping before deleting; Windows refuses to delete a mapped
+        # file (a reader elsewhere may still map one: it is retried next time).
+        self.embeddings = np.zeros((0, self.dim), dtype=np.float32)
+        self._invalidate()
+        self._delete_old_generations(generation)
+
+    def _delete_old_generations(self, current):
+        directory = os.path.dirname(self.meta_path) or "."
+        # <base>.<G>.f32 / <base>.<G>.wal.jsonl, and the pre-generation <base>.f32 / <base>.wal.jsonl
+        pattern = re.compile(re.escape(os.path.basename(self.base)) + r"\.(\d+\.)?(f32|wal\.jsonl)")
+        keep = {os.path.basename(p) for p in self._generation_paths(current)}
+        for name in os.listdir(directory):
+            if name not in keep and pattern.fullmatch(name):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+    def compact(self):
+        """Rewrite the live rows into a fresh snapshot and empty the WAL."""
+        with self._lock, self._writer_lock():
+            self._flush(allow_compact=False)
+            rows = self._live_row_indices()
+            matrix = np.asarray(self.embeddings)[rows] if len(rows) else np.zeros((0, self.dim), dtype=np.float32)
+            self._write_snapshot(
+                [self.ids[r] for r in rows],
+                [self.documents[r] for r in rows],
+                [self.metadatas[r] for r in rows],
+                matrix,
+            )
+            self._load()
+
+    def rebuild(self, documents, embeddings, metadatas, ids):
+        """
+        Replace everything in the store with these vectors, written as a new
+        snapshot. Unlike upsert the dimension may change, e.g. after switching
+        EMBEDDING_BACKEND; other processes pick the snapshot up on refresh().
+        """
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        with self._lock, self._writer_lock():
+            self._pending = []
+            self.dim = matrix.shape[1] if len(ids) else 0
+            self._write_snapshot([str(i) for i in ids], list(documents), list(metadatas), matrix)
+            self._load()
+
+    def save(self):
+        """Persist pending upserts (kept for callers of the old JSON store)."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self, allow_compact=True):
+        if not self._pending:
+            return
+        with self._writer_lock():
+            self._flush_locked(allow_compact)
+
+    def _flush_locked(self, allow_compact):
+        # Holding the writer lock: catch up with rows other processes appended
+        # since we last looked, so ours go after theirs.
+        self.refresh()
+        if self.dim == 0:
+            self.dim = len(self._pending[0][1])
+        if self._meta_stamp is None:
+            # Brand-new store: WAL records need a snapshot to hang off.
+            self._write_snapshot([], [], [], np.zeros((0, self.dim), dtype=np.float32))
+            self._load()
+
+        start = len(self.ids)
+        matrix = np.stack([emb for _, emb, _, _ in self._pending]).astype(np.float32, copy=False)
+        with open(self.vectors_path, 'ab') as f:
+            # Drop any bytes a crashed writer appended without a WAL record.
+            f.truncate(start * self.dim * 4)
+            f.write(matrix.tobytes())
+
+        lines = []
+        for offset, (_id, _, doc, meta) in enumerate(self._pending):
+            lines.append(json.dumps({
+                "g": self.generation, "row": start + offset, "dim": self.dim,
+                "id": _id, "document": doc, "metadata": meta,
+            }, separators=(',', ':')))
+        with open(self.wal_path, 'ab') as f:
+            f.write(("\n".join(lines) + "\n").encode('utf-8'))
+
+        self._pending = []
+        self._replay_wal()
+
+        if allow_compact and self._wal_records >= max(self.COMPACT_MIN_WAL_RECORDS, len(self._row)):
+            self.compact()
+
+    @contextmanager
+    def batch(self):
+        """
+        Group many upserts into one disk write::
+
+            with collection.batch():
+                for movie in movies:
+                    collection.upsert(...)
+        """
+        # The lock is not held across the body, so searches keep being served
+        # (from the pre-batch data) while a slow loader fills the batch.
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._flush()
+
+    # ── Collection API ───────────────────────────────────────
+
+    def count(self):
+        return len(self._row)
+
+    def has(self, _id):
+        """Whether a vector is stored for ``_id``."""
+        return str(_id) in self._row
+
+    def upsert(self, documents, embeddings, metadatas, ids):
+        if not ids:
+            return
+        new_embs = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        with self._lock:
+            dim = self.dim or (len(self._pending[0][1]) if self._pending else new_embs.shape[1])
+            if new_embs.shape[1] != dim:
+                raise ValueError(f"Embedding dimension {new_embs.shape[1]} does not match store dimension {dim}")
+            for doc, emb, meta, _id in zip(documents, new_embs, metadatas, ids):
+                self._pending.append((str(_id), emb, doc, meta))
+            if self._batch_depth == 0:
+                self._flush()
+
+    def _live_row_indices(self):
+        if self._live_rows is None:
+            self._live_rows = np.fromiter(sorted(self._row.values()), dtype=np.int64, count=len(self._row))
+        return self._live_rows
+
+    def _exact_vectors(self, positions):
+        """Full-precision unit vectors for the given live positions, read from the memmap."""
+        matrix = np.asarray(self.embeddings[self._live_row_indices()[positions]], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _compressed_matrix(self):
+        """
+        The resident copy of the live vectors that queries scan, built once per
+        change: unit-length rows in ``storage_dtype``. int8 rows carry a float32
+        scale each (vector ~= codes * scale). Zero vectors stay zero.
+        """
+        if self._compressed is None:
+            live = len(self._row)
+            codes = np.empty((live, self.dim), dtype=self.storage_dtype)
+            scales = np.ones(live, dtype=np.float32) if self.storage_dtype == np.int8 else None
+            # Chunked so a quantized build never holds a full float32 copy.
+            for start in range(0, live, self.CHUNK_ROWS):
+                block = self._exact_vectors(np.arange(start, min(start + self.CHUNK_ROWS, live)))
+                if scales is None:
+                    codes[start:start + len(block)] = block
+                else:
+                    peak = np.abs(block).max(axis=1)
+                    peak[peak == 0] = 1.0
+                    scales[start:start + len(block)] = peak / 127.0
+                    codes[start:start + len(block)] = np.round(block / scales[start:start + len(block), None])
+            self._compressed = (codes, scales)
+        return self._compressed
+
+    def _vectors(self, positions):
+        """Approximate (decompressed) unit vectors for the given live positions."""
+        codes, scales = self._compressed_matrix()
+        block = codes[positions].astype(np.float32)
+        if scales is not None:
+            block *= scales[positions, None]
+        return block
+
+    def _scores(self, queries, positions=None):
+        """Similarity of unit ``queries`` to live vectors (all, or ``positions``) on the compressed form."""
+        codes, scales = self._compressed_matrix()
+        if positions is None:
+            if codes.dtype == np.float32:
+                return queries @ codes.T
+            positions = np.arange(len(codes))
+        out = np.empty((len(queries), len(positions)), dtype=np.float32)
+        for start in range(0, len(positions), self.CHUNK_ROWS):
+            chunk = positions[start:start + self.CHUNK_ROWS]
+            out[:, start:start + len(chunk)] = queries @ self._vectors(chunk).T
+        return out
+
+    def _column(self, field):
+        """Columnar view of one metadata field over the live rows, built once per change."""
+        column = self._columns.get(field)
+        if column is None:
+            column = _MetadataColumn([(self.metadatas[r] or {}).get(field) for r in self._live_row_indices()])
+            self._columns[field] = column
+        return column
+
+    def _where_mask(self, where):
+        """
+        Boolean mask over the live rows for a Chroma-style ``where`` filter:
+        ``{"field": value}``, ``{"field": {"$op": value}}`` with $eq, $ne, $lt,
+        $lte, $gt, $gte, $in, $nin and $contains (list fields), combined with
+        ``$and`` / ``$or``.
+
+        Unlike Chroma, rows that don't carry a filtered field are kept, so
+        vectors written before a field existed stay searchable until they are
+        backfilled.
+        """
+        mask = np.ones(len(self._row), dtype=bool)
+        for key, cond in where.items():
+            if key == '$and':
+                for sub in cond:
+                    mask &= self._where_mask(sub)
+            elif key == '$or':
+                any_mask = np.zeros(len(self._row), dtype=bool)
+                for sub in cond:
+                    any_mask |= self._where_mask(sub)
+                mask &= any_mask
+            else:
+                if not isinstance(cond, dict):
+                    cond = {'$eq': cond}
+                column = self._column(key)
+                for op, value in cond.items():
+                    mask &= column.match(op, value)
+        return mask
+
+    def _ivf_lists(self):
+        """
+        Inverted lists over the live rows, or None while there are no usable
+        centroids. Rows appended since the last call are assigned to their
+        nearest cell. Fitting the cells (once the catalogue is big enough, and
+        again each time it doubles) is started on a background thread, so no
+        query waits for k-means: until it finishes, queries use the previous
+        centroids, or the first time an exact scan.
+        """
+        if self._lists is not None:
+            return self._lists
+        rows = self._live_row_indices()
+        if self._training is None and self._ivf.needs_training(len(rows), self.dim):
+            self._training = threading.Thread(target=self._train_in_background, name="ivf-train", daemon=True)
+            self._training.start()
+        if self._ivf.centroids is None or self._ivf.centroids.shape[1] != self.dim or len(rows) < self._ivf.min_train_size:
+            return None
+
+        if len(self._labels) < len(self.ids):
+            self._labels = np.concatenate([self._labels, np.full(len(self.ids) - len(self._labels), -1, dtype=np.int32)])
+        live_labels = self._labels[rows]
+        missing = np.flatnonzero(live_labels < 0)
+        for start in range(0, len(missing), self.CHUNK_ROWS):
+            chunk = missing[start:start + self.CHUNK_ROWS]
+            live_labels[chunk] = self._ivf.assign(self._vectors(chunk))
+        self._labels[rows[missing]] = live_labels[missing]
+
+        self._lists = self._ivf.build_lists(live_labels)
+        return self._lists
+
+    def train_index(self):
+        """
+        Fit the IVF cells now if they are missing or stale. k-means runs on a
+        sample copied out under the lock, so searches go on meanwhile.
+        """
+        with self._lock:
+            rows = self._live_row_indices()
+            if self._ivf is None or not self._ivf.needs_training(len(rows), self.dim):
+                return
+            rng = np.random.default_rng(self._ivf.seed)
+            picks = rng.choice(len(rows), size=min(len(rows), self._ivf.sample_size(len(rows))), replace=False)
+            sample = self._vectors(np.sort(picks))
+            size, dim = len(rows), self.dim
+        centroids = self._ivf.fit(sample, size)
+        with self._lock:
+            if dim != self.dim:
+                return  # rebuilt at another dimension meanwhile
+            self._ivf.use(centroids, size)
+            self._labels = np.full(len(self.ids), -1, dtype=np.int32)
+            self._lists = None
+
+    def _train_in_background(self):
+        try:
+            self.train_index()
+        except Exception as e:
+            print(f"IVF training failed: {e}")
+        finally:
+            with self._lock:
+                self._training = None
+
+    def query(self, query_embeddings, n_results=10, where=None):
+        """
+        Cosine-similarity search. Every embedding in ``query_embeddings`` is
+        answered by the same batched matmul; results come back per query in
+        Chroma's nested-list shape. ``where`` restricts the search to rows whose
+        metadata match (see ``_where_mask``) before the top-k is taken, so a
+        narrow filter still gets a full ``n_results``. With ``index_type='ivf'`` each query is
+        scored only against the vectors in its closest cells. With a
+        compressed ``storage_dtype`` the best ``rerank`` candidates are
+        re-scored at full precision before the final cut.
+        """
+        n_queries = len(query_embeddings)
+        if n_queries == 0:
+            return {"ids": [[]], "distances": [[]]}
+
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(n_queries, -1)
+        q_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        q_norms[q_norms == 0] = 1.0
+        queries = queries / q_norms
+
+        with self._lock:
+            live = len(self._row)
+            if not live:
+                return {"ids": [[] for _ in range(n_queries)], "distances": [[] for _ in range(n_queries)]}
+            rows = self._live_row_indices()
+            ids = self.ids
+            lists = self._ivf_lists() if self._ivf is not None else None
+            compressed = self.storage_dtype != np.float32
+            shortlist = max(n_results, self.rerank) if compressed else n_results
+
+            eligible = None
+            if where:
+                mask = self._where_mask(where)
+                eligible = np.flatnonzero(mask)
+                if len(eligible) == 0:
+                    return {"ids": [[] for _ in range(n_queries)], "distances": [[] for _ in range(n_queries)]}
+
+            if lists is None:
+                if eligible is None:
+                    tops, scores = _top_k(self._scores(queries), shortlist)
+                else:
+                    top, scores = _top_k(self._scores(queries, eligible), shortlist)
+                    tops = eligible[top]
+            else:
+                tops, scores = [], []
+                for q in queries:
+                    cand = self._ivf.candidates(q, lists)
+                    if eligible is not None:
+                        cand = cand[mask[cand]]
+                    if len(cand) < n_results:
+                        # Sparse cells: not enough candidates, answer exactly.
+                        cand = eligible if eligible is not None else np.arange(live)
+                    top, score = _top_k(self._scores(q[None, :], cand), shortlist)
+                    tops.append(cand[top[0]])
+                    scores.append(score[0])
+
+            if compressed:
+                # Re-rank the shortlist against the float32 vectors on disk.
+                reranked_tops, reranked_scores = [], []
+                for q, top in zip(queries, tops):
+                    exact = self._exact_vectors(top) @ q
+                    order, score = _top_k(exact[None, :], n_results)
+                    reranked_tops.append(top[order[0]])
+                    reranked_scores.append(score[0])
+                tops, scores = reranked_tops, reranked_scores
+
+        return {
+            "ids": [[ids[rows[i]] for i in row] for row in tops],
+            "distances": [[float(1.0 - s) for s in row] for row in scores]
+        }
+
+def _top_k(similarities, k):
+    """Row-wise best ``k`` (indices, scores) of a 2-D similarity matrix, best first."""
+    n = similarities.shape[1]
+    k = min(k, n)
+    # argpartition finds the k best in O(n); only those k are then sorted.
+    if k < n:
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(n), similarities.shape)
+    scores = np.take_along_axis(similarities, top, axis=1)
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+class _MetadataColumn:
+    """
+    One metadata field as arrays: scalars as a float (or object) vector,
+    list fields (genres, moods) as bitsets.pack()ed masks over a per-column
+    Vocabulary of the values seen.
+    """
+
+    def __init__(self, values):
+        self.present = np.array([v is not None for v in values], dtype=bool)
+        self.is_tags = any(isinstance(v, (list, tuple)) for v in values)
+        if self.is_tags:
+            self.vocab = bitsets.Vocabulary(())
+            masks = [self.vocab.mask(v or []) for v in values]
+            self.bits = bitsets.pack(masks, self.vocab.words)
+        else:
+            try:
+                self.values = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            except (TypeError, ValueError):
+                self.values = np.array(values, dtype=object)
+
+    def _has_tag(self, tag):
+        return bitsets.has_bit(self.bits, self.vocab.bit(tag))
+
+    def match(self, op, value):
+        if not self.present.any():
+            # No row carries the field yet (e.g. a store migrated from the old
+            # JSON file, before backfill_chroma): nothing to filter on.
+            return np.ones(len(self.present), dtype=bool)
+        if self.is_tags:
+            if op in ('$contains', '$eq'):
+                hit = self._has_tag(value)
+            elif op == '$in':
+                hit = np.zeros(len(self.present), dtype=bool)
+                for tag in value:
+                    hit |= self._has_tag(tag)
+            elif op == '$ne':
+                hit = ~self._has_tag(value)
+            else:
+                raise ValueError(f"Unsupported operator {op} for list metadata")
+        else:
+            with np.errstate(invalid='ignore'):
+                if op == '$eq':
+                    hit = self.values == value
+                elif op == '$ne':
+                    hit = self.values != value
+                elif op == '$lt':
+                    hit = self.values < value
+                elif op == '$lte':
+                    hit = self.values <= value
+                elif op == '$gt':
+                    hit = self.values > value
+                elif op == '$gte':
+                    hit = self.values >= value
+                elif op == '$in':
+                    hit = np.isin(self.values, list(value))
+                elif op == '$nin':
+                    hit = ~np.isin(self.values, list(value))
+                else:
+                    raise ValueError(f"Unsupported operator {op}")
+        # Rows without the field are not filtered out.
+        return hit | ~self.present
+
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index over unit vectors.
+
+    Spherical k-means splits the catalogue into ``nlist`` cells. A query is
+    scored against the centroids first and then only against the vectors in
+    its ``nprobe`` closest cells. Pure NumPy; centroids are cached next to the
+    store (``<base>.ivf.npz``) so workers don't all retrain on startup.
+    """
+
+    def __init__(self, path=None, nlist=None, nprobe=8, min_train_size=1024, iterations=10, seed=0):
+        self.path = path
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        if path and os.path.exists(path):
+            try:
+                with np.load(path) as saved:
+                    self.centroids = saved["centroids"]
+                    self.trained_size = int(saved["trained_size"])
+            except Exception as e:
+                print(f"Ignoring unreadable IVF centroids {path}: {e}")
+
+    def needs_training(self, size, dim):
+        if size < self.min_train_size:
+            return False
+        if self.centroids is None or self.centroids.shape[1] != dim:
+            return True
+        # Retrain once the catalogue has doubled since the centroids were fit.
+        return size >= 2 * self.trained_size
+
+    def sample_size(self, size):
+        nlist = self.nlist or max(1, int(np.sqrt(size)))
+        # k-means on a sample is plenty to place the cells.
+        return nlist * 64
+
+    def fit(self, sample, size):
+        """Cells for ``sample`` (unit vectors) drawn from a catalogue of ``size`` vectors; see use()."""
+        rng = np.random.default_rng(self.seed)
+        nlist = min(self.nlist or max(1, int(np.sqrt(size))), len(sample))
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+        return centroids
+
+    def use(self, centroids, size):
+        """Switch to centroids from fit() and save them next to the store."""
+        self.centroids = centroids
+        self.trained_size = size
+        if self.path:
+            try:
+                tmp = self.path + ".tmp.npz"
+                np.savez(tmp, centroids=centroids, trained_size=size)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"Could not persist IVF centroids: {e}")
+        print(f"Trained IVF index: {len(centroids)} cells over {size} vectors")
+
+    def assign(self, matrix):
+        if len(matrix) == 0:
+            return np.zeros(0, dtype=np.int32)
+        return np.argmax(matrix @ self.centroids.T, axis=1).astype(np.int32)
+
+    def build_lists(self, labels):
+        """Group live positions by cell: positions[offsets[c]:offsets[c + 1]] are cell c."""
+        order = np.argsort(labels, kind='stable')
+        offsets = np.searchsorted(labels[order], np.arange(len(self.centroids) + 1))
+        return order, offsets
+
+    def candidates(self, query, lists):
+        order, offsets = lists
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probes])
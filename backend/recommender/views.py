@@ -4,7 +4,7 @@ from rest_framework import status
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 from .models import Movie, WatchHistory, UserProfile
-from .services import get_recommendations, prolog
+from .services import rank_recommendations, hydrate_recommendations, ranking_params, store_ranking, load_ranking, set_user_like
 
 class RegisterView(APIView):
     def post(self, request):
@@ -57,17 +57,10 @@ class LikeMovieView(APIView):
                 defaults={'liked': liked}
             )
             
-            if liked:
-                try:
-                    check = list(prolog.query(f"user_likes({user.id}, {movie.tmdb_id})"))
-                    if not check:
-                        prolog.assertz(f"user_likes({user.id}, {movie.tmdb_id})")
-                except Exception as e:
-                    print(f"Error asserting user_likes: {e}")
-            else:
-                 try:
-                    list(prolog.query(f"retractall(user_likes({user.id}, {movie.tmdb_id}))"))
-                 except: pass
+            try:
+                set_user_like(user.id, movie.tmdb_id, liked)
+            except Exception as e:
+                print(f"Error updating user_likes: {e}")
 
             return Response({'message': 'Preference saved'}, status=status.HTTP_200_OK)
         except Exception as e:
@@ -106,28 +99,49 @@ class RecommendMovieView(APIView):
             except Exception as e:
                 pass  # Celery not available locally, continue serving what we have
 
-        recommendations = get_recommendations(genre, mood, age, search_query, user_id)
-        
-        if not recommendations:
-             return Response({"message": "No movies found matching your preferences. Try adjusting them!"}, status=status.HTTP_200_OK)
-             
-        # Optional Pagination Support for Infinite Grid Scroll
-        page = int(request.data.get('page', 1))
-        limit = int(request.data.get('limit', 20)) # default 20 per page
-        
-        start_idx = (page - 1) * limit
-        end_idx = start_idx + limit
-        
-        paginated_recs = recommendations[start_idx:end_idx]
-        
+        # Cursor Pagination for Infinite Grid Scroll
+        # Page 1 ranks once and stores the ranked list under a token; each
+        # nextCursor ("<token>.<offset>") then only hydrates its own slice.
+        try:
+            limit = int(request.data.get('limit', 20)) # default 20 per page
+        except (TypeError, ValueError):
+            limit = 20
+        cursor = request.data.get('cursor')
+        page = request.data.get('page', 1)
+        if not cursor and isinstance(page, str) and not page.isdigit():
+            cursor = page  # clients that echo nextCursor back as `page`
+
+        params = ranking_params(genre, mood, age, search_query, user_id)
+        ranked = None
+        offset = 0
+        if cursor:
+            token, _, offset_str = str(cursor).partition('.')
+            offset = int(offset_str) if offset_str.isdigit() else 0
+            ranked = load_ranking(token, params)
+        else:
+            try:
+                offset = (max(int(page), 1) - 1) * limit
+            except (TypeError, ValueError):
+                offset = 0
+
+        if ranked is None:
+            # First page, or the cursor expired / belongs to other parameters:
+            # rank again and carry on from the offset
+            ranked = rank_recommendations(genre, mood, age, search_query, user_id)
+            if not ranked:
+                 return Response({"message": "No movies found matching your preferences. Try adjusting them!"}, status=status.HTTP_200_OK)
+            token = store_ranking(ranked, params)
+
+        end_idx = offset + limit
+        paginated_recs = hydrate_recommendations(ranked[offset:end_idx])
+
         # Calculate if there is a next page
-        has_next = end_idx < len(recommendations)
-        next_page = page + 1 if has_next else None
+        next_cursor = f"{token}.{end_idx}" if end_idx < len(ranked) else None
 
         return Response({
             "recommendations": paginated_recs,
-            "nextCursor": next_page,
-            "totalResults": len(recommendations)
+            "nextCursor": next_cursor,
+            "totalResults": len(ranked)
         }, status=status.HTTP_200_OK)
 class SetupDatabaseView(APIView):
     """
@@ -28,7 +28,7 @@ interface FetchRecommendationsParams {
   age: number;
   search_query: string;
   user_id?: number;
-  pageParam?: number;
+  pageParam?: number | string;
 }
 
 export default function Home() {
@@ -70,7 +70,9 @@ export default function Home() {
     const rawApiUrl = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
     const API_URL = rawApiUrl.replace(/\/$/, '');
 
-    const payload = { ...prefs, user_id: userId, page: pageParam, limit: 20 };
+    // Page 1 ranks; later pages pass back the opaque nextCursor from the previous response
+    const position = typeof pageParam === 'string' ? { cursor: pageParam } : { page: pageParam };
+    const payload = { ...prefs, user_id: userId, ...position, limit: 20 };
 
     const response = await fetch(`${API_URL}/api/recommend/`, {
       method: 'POST',
@@ -106,7 +108,7 @@ export default function Home() {
   } = useInfiniteQuery({
     queryKey: ['recommendations', currentPrefs, user?.user_id],
     queryFn: fetchMovies,
-    initialPageParam: 1,
+    initialPageParam: 1 as number | string,
     getNextPageParam: (lastPage) => lastPage.nextCursor ?? undefined,
     retry: (failureCount, error) => {
       // If DB is building, retry every 5 seconds infinitely